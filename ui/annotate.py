@@ -1,76 +1,110 @@
+from atomic_file import atomic_write
 from ccut.main.dimension import DimensionVector
 from ccut.main.dimension_map import DimensionMap
 from ccut.main.symbol_map import SymbolMap
+from ccut_cache import get_ccut_fingerprint
+from fuzzy_index import FuzzyIndex
 from fuzzywuzzy.process import extract
+from json import dumps, load
+from os.path import exists
 from re import findall
+from types import MappingProxyType
 
 QUDT_NAMESPACE = 'http://www.qudt.org/qudt/owl/1.0.0/unit/Instances.html#'
 URI_SEPARATOR = '#'
 NUM_RESULTS_TO_SUGGEST = 5
 
-# list to hold auto-complete SHEET options
-sheet_flat_list = list()
-# list to hold auto-complete UNIT PREFIX options
-prefix_flat_list = list()
-# list to hold auto-complete UNIT options
-unit_flat_list = list()
-# dictionary mapping from UNIT uri to its QUANTITY KIND (i.e., Gram -> Mass)
-uri_to_qkind = dict()
-
-def init_flat_search_lists(active_dict):
-    ''' Init the auto-complete lists and dictionaries '''
-
-    global sheet_flat_list, prefix_flat_list, unit_flat_list, uri_to_qkind
-
-    # Init SHEET options
-    for sheet_n in active_dict.keys():
-        if sheet_n not in sheet_flat_list:
-            sheet_flat_list.append(sheet_n)
-
-    # Init UNIT PREFIX options
-    if len(prefix_flat_list) == 0:
-        d = SymbolMap.get_instance()
-        for _, sym_d in d.si_prefix_map.items():
-            inst_uri = sym_d.uri
+# tuple of auto-complete UNIT PREFIX options
+prefix_options = tuple()
+# tuple of auto-complete UNIT options
+unit_options = tuple()
+# (read-only) dictionary mapping from UNIT uri to its QUANTITY KIND (i.e., Gram -> Mass)
+uri_to_qkind = MappingProxyType(dict())
+# search index over the UNIT options (see fuzzy_search_unit)
+unit_search_index = None
+
+def build_search_tables():
+    ''' Walk CCUT's symbol map, return the (prefix options, unit options, unit uri to quantity kind) tables '''
+
+    prefixes = dict() # used as an ordered set
+    d = SymbolMap.get_instance()
+    for _, sym_d in d.si_prefix_map.items():
+        inst_uri = sym_d.uri
+        if URI_SEPARATOR in inst_uri:
+            prefixes[str(inst_uri).split(URI_SEPARATOR)[1]] = None
+
+    units = dict() # used as an ordered set
+    qkinds = dict()
+    for _, sym_d in d.symbol_map.items():
+        for op_qu in sym_d:
+            inst_uri = op_qu[1].uri # each is a tuple of (prio, qu)
             if URI_SEPARATOR in inst_uri:
                 prefixeless_uri = str(inst_uri).split(URI_SEPARATOR)[1]
-                if prefixeless_uri not in prefix_flat_list:
-                    prefix_flat_list.append(prefixeless_uri)
-
-    # Init UNIT options and QUANTITY KIND dictionary
-    if len(unit_flat_list) == 0:
-        d = SymbolMap.get_instance()
-        for _, sym_d in d.symbol_map.items():
-            for op_qu in sym_d:
-                inst_uri = op_qu[1].uri # each is a tuple of (prio, qu)
-                if URI_SEPARATOR in inst_uri:
-                    prefixeless_uri = str(inst_uri).split(URI_SEPARATOR)[1]
-                    if prefixeless_uri not in unit_flat_list:
-                        unit_flat_list.append(prefixeless_uri)
-                        if hasattr(op_qu[1], 'quantity_kind'):
-                            uri_to_qkind[prefixeless_uri] = op_qu[1].quantity_kind.rsplit(URI_SEPARATOR)[1]
-                        
-
-def fuzzy_search_sheet(query):
-    ''' Get top SHEET results matching (fuzzy-search) a given query '''
-
-    global sheet_flat_list
-
-    return extract(query, sheet_flat_list, limit=NUM_RESULTS_TO_SUGGEST)
+                if prefixeless_uri not in units:
+                    units[prefixeless_uri] = None
+                    if hasattr(op_qu[1], 'quantity_kind'):
+                        qkinds[prefixeless_uri] = op_qu[1].quantity_kind.rsplit(URI_SEPARATOR)[1]
+
+    return list(prefixes), list(units), qkinds
+
+def init_search_tables(tables_fname=None):
+    ''' Init the auto-complete tables and the quantity kind dictionary (once).
+    If tables_fname is given, the tables are loaded from this file (json) when it matches the installed CCUT,
+    otherwise they are built from CCUT's symbol map and written to it. '''
+
+    global prefix_options, unit_options, uri_to_qkind, unit_search_index
+
+    if unit_search_index is not None:
+        return
+
+    tables = None
+    fingerprint = get_ccut_fingerprint() if tables_fname else None
+    if tables_fname and exists(tables_fname):
+        try:
+            with open(tables_fname, 'r') as read_file:
+                tables = load(read_file)
+        except ValueError:
+            tables = None
+        if tables is not None and tables.get('fingerprint') != fingerprint:
+            tables = None
+    if tables is None:
+        prefixes, units, qkinds = build_search_tables()
+        tables = {'fingerprint': fingerprint, 'prefixes': prefixes, 'units': units, 'qkinds': qkinds}
+        if tables_fname:
+            # written at once, as other processes may be reading it
+            atomic_write(tables_fname, dumps(tables))
+
+    prefix_options = tuple(tables['prefixes'])
+    unit_options = tuple(tables['units'])
+    uri_to_qkind = MappingProxyType(tables['qkinds'])
+    unit_search_index = FuzzyIndex(unit_options)
+
+def get_unit_options():
+    ''' Return the auto-complete UNIT options '''
+
+    init_search_tables()
+    return unit_options
+
+def fuzzy_search_sheet(query, active_dict):
+    ''' Get top SHEET results (sheets of the given annotation dictionary) matching (fuzzy-search) a given query '''
+
+    return extract(query, list(active_dict.keys()) if active_dict else list(), limit=NUM_RESULTS_TO_SUGGEST)
 
 def fuzzy_search_prefix(query):
     ''' Get top PREFIX results matching (fuzzy-search) a given query '''
 
-    global prefix_flat_list
+    global prefix_options
 
-    return extract(query, prefix_flat_list, limit=NUM_RESULTS_TO_SUGGEST)
+    init_search_tables()
+    return extract(query, prefix_options, limit=NUM_RESULTS_TO_SUGGEST)
 
 def fuzzy_search_unit(query):
-    ''' Get top UNIT results matching (fuzzy-search) a given query '''
+    ''' Get top UNIT results matching (fuzzy-search) a given query (shortlisted with a trigram index) '''
 
-    global unit_flat_list
+    global unit_search_index
 
-    return extract(query, unit_flat_list, limit=NUM_RESULTS_TO_SUGGEST)
+    init_search_tables()
+    return unit_search_index.search(query, NUM_RESULTS_TO_SUGGEST)
 
 def get_column_row_from_cell_string(cell_string):
     ''' Return column and row string for a given cell string (i.e., 'A15' -> 'A', '15') '''
@@ -112,6 +146,7 @@ def update_cell_dimension(ant_dict, sheet, cell):
 
     global uri_to_qkind
 
+    init_search_tables()
     dim_vec = DimensionVector()
     d = DimensionMap.get_instance()
     cell_col, cell_row = get_column_row_from_cell_string(cell)
@@ -132,3 +167,64 @@ def update_cell_dimension(ant_dict, sheet, cell):
                     dim_vec += DimensionVector().set_dimensions(dimension).raise_to_power(unt_exp)
     cell_dict['dimension'] = dim_vec.get_abbr()
 
+def remove_annotation(ant_dict, sheet, col=None, row=None, idx=None):
+    ''' Remove an element from a given dictionary of annotations: the idx-th (1-based) unit-part of a cell,
+    a cell (col and row), or a whole sheet. Elements left empty are removed as well (a cell without parts,
+    a column without cells, a sheet without columns). Returns the name of the largest element removed
+    ('part', 'cell' or 'sheet'). '''
+
+    if col is not None and row is not None:
+        if idx is not None:
+            del ant_dict[sheet][col][row][0]['parts'][int(idx)-1]
+            update_cell_dimension(ant_dict, sheet, col+row)
+            # if there are more unit-parts in cell, return
+            if len(ant_dict[sheet][col][row][0]['parts']) != 0:
+                return 'part'
+            # otherwise, continute to remove row (cell)
+        del ant_dict[sheet][col][row]
+        # if there are no more rows in col, delete col
+        if len(ant_dict[sheet][col]) == 0:
+            del ant_dict[sheet][col]
+        # if there are more cols in sheet, return
+        if len(ant_dict[sheet]) != 0:
+            return 'cell'
+        # otherwise, continute to remove sheet
+    del ant_dict[sheet]
+    return 'sheet'
+
+def match_cell_annotation(col, row, cell_list, query):
+    ''' Check if a cell matches a (case-insensitive) query: its name (i.e., 'A15'), dimension or unit-parts contain it '''
+
+    query = query.lower()
+    if query in (col+row).lower():
+        return True
+    for c_unit in cell_list:
+        if query in c_unit.get('dimension', '').lower():
+            return True
+        for unit in c_unit['parts']:
+            for key in ['p', 'u']:
+                if key in unit and query in unit[key].rsplit(URI_SEPARATOR)[-1].lower():
+                    return True
+    return False
+
+def get_annotation_page(ant_dict, sheet, col=None, query=None, page=1, page_size=100):
+    ''' Return a page of the cells of a sheet in a given dictionary of annotations, optionally of a single column
+    and/or matching a query (see match_cell_annotation). Cells are ordered as in the dictionary.
+    The page is a dictionary holding the sheet's columns, the number of matching cells and pages, and the cells
+    of the page as {'column', 'row', 'cell'} (cell being the list of compound units of the cell). '''
+
+    sheet_d = ant_dict.get(sheet, dict()) if ant_dict else dict()
+    cells = list()
+    for col_n, col_d in sheet_d.items():
+        if col is not None and col_n != col:
+            continue
+        for row_n, row_d in col_d.items():
+            if query and not match_cell_annotation(col_n, row_n, row_d, query):
+                continue
+            cells.append({'column': col_n, 'row': row_n, 'cell': row_d})
+
+    num_of_pages = max((len(cells) + page_size - 1) // page_size, 1)
+    page = min(max(page, 1), num_of_pages)
+    return {'sheet': sheet, 'columns': list(sheet_d.keys()), 'num_of_cells': len(cells),
+            'page': page, 'page_size': page_size, 'num_of_pages': num_of_pages,
+            'cells': cells[(page-1)*page_size:page*page_size]}
@@ -1,36 +1,135 @@
-from annotate import init_flat_search_lists, fuzzy_search_sheet, fuzzy_search_prefix, \
-                    fuzzy_search_unit, add_annotation_to_cell, update_cell_dimension
-from ccut import ccut
+from annotate import init_search_tables, fuzzy_search_sheet, fuzzy_search_prefix, fuzzy_search_unit, \
+                     get_annotation_page, get_column_row_from_cell_string
+from baselutils import fclrprint
 from ccut.main.config import Config
-from ccut_sheets import init_globals, process_file, colorize_spreadsheet
-from flask import Flask, request, redirect, jsonify, render_template, url_for
-from forms import ParseForm, ConversionForm, FileUploadForm, AnnotationEditForm
-from json import load, dump, dumps
-from os import makedirs
-from os.path import exists
+from ccut_cache import make_private_dir
+from ccut_columnar import write_annotation_file, get_annotation_fname
+from ccut_conversion import get_all_ccu_cached, get_conversion_plan, apply_conversion_plan, \
+                            get_conversion_cache_stats
+from ccut_sheets import init_globals, get_ccut_instance, process_file, colorize_spreadsheet
+from edit_journal import AnnotationFileCache, EDIT_ADD, EDIT_REMOVE, EDIT_JOURNAL_COMPACT_SIZE
+from flask import Flask, request, redirect, jsonify, render_template, session, url_for
+from forms import ParseForm, ConversionForm, FileUploadForm, SpreadsheetUploadForm, AnnotationEditForm
+from job_queue import JobQueue, JOB_DONE
+from json import dumps
+from os import environ, makedirs
+from os.path import exists, join
+from re import fullmatch
+from session_store import SessionStore
+from uuid import uuid4
 from werkzeug.utils import secure_filename
 
 # Directory to store temporary work files
 STORAGE_FOLDER = '/tmp/ccut_uploads/'
+# Precomputed auto-complete tables (built from CCUT's symbol map on first run)
+SEARCH_TABLES_FILE = STORAGE_FOLDER + 'search_tables.json'
+# If set, CCUT's symbol/dimension maps are snapshot (on first run) to, and loaded from, this directory (private to the app's user)
+CCUT_MAPS_SNAPSHOT_FOLDER = environ.get('CCUT_MAPS_SNAPSHOT_FOLDER')
+# Number of seconds an unused session (and its state) is kept
+SESSION_TTL = 12 * 60 * 60
+# If set, session states are stored in this directory (shared by all worker processes) instead of in memory
+SESSION_STORAGE_FOLDER = environ.get('CCUT_SESSION_FOLDER')
+# If set, saving colors the annotated cells into an overlay file (<name>.ccut_overlay.xlsx) instead of the spreadsheet itself
+SPREADSHEET_OVERLAY = bool(environ.get('CCUT_SPREADSHEET_OVERLAY'))
+# Number of annotated cells served per page of the editor-UI (and maximal number a client may ask for)
+ANNOTATION_PAGE_SIZE = 100
+ANNOTATION_MAX_PAGE_SIZE = 1000
+# Number of annotation files kept loaded in memory (shared by the sessions of a worker process)
+ANNOTATION_FILE_CACHE_MAX_SIZE = 16
+# Number of background extraction jobs run at once (jobs share the parse caches of ccut_sheets, run them one at a time)
+JOB_QUEUE_NUM_OF_WORKERS = 1
 
 # Init Flask app
 app = Flask(__name__)
 app.config.from_object(Config)
-# Init ccut sheets processor
-init_globals()
-# Init ccut instance
-ccut = ccut()
-# Init global variables
-g_active_json = dict()
-g_active_filename = ""
-g_active_xlsx_fname = ""
-''' g_conv_res tuple contains:
-    0: conv_val     1,2: conv_sts    3: orig_val     
+# Init ccut sheets processor (and the shared ccut instance, loaded on first use)
+if not exists(STORAGE_FOLDER):
+    makedirs(STORAGE_FOLDER)
+maps_snapshot_file = None
+if CCUT_MAPS_SNAPSHOT_FOLDER:
+    if make_private_dir(CCUT_MAPS_SNAPSHOT_FOLDER):
+        maps_snapshot_file = join(CCUT_MAPS_SNAPSHOT_FOLDER, 'ccut_maps.json')
+    else:
+        fclrprint(f'{CCUT_MAPS_SNAPSHOT_FOLDER} is accessible to other users, not using a maps snapshot', 'r')
+init_globals(maps_snapshot_file=maps_snapshot_file)
+# Init auto-complete tables
+init_search_tables(SEARCH_TABLES_FILE)
+
+# --- session state -----------------------------------------------------------
+
+def new_session_state():
+    ''' Return the state of a new session.
+    conv_res tuple contains:
+    0: conv_val     1,2: conv_sts    3: orig_val
     4: src_str_list 5: dst_str_list  6: src_list     7: dst_list
-'''
-g_conv_res = list()
-g_conv_src_idx = 1
-g_conv_dst_idx = 1
+    '''
+
+    return {'active_filename': '', 'active_xlsx_fname': '',
+            'conv_res': list(), 'conv_src_idx': 1, 'conv_dst_idx': 1, 'conv_units': ('', '')}
+
+# Init session store (states only reference the session's files, the active annotations are kept in g_annotation_files),
+# expired sessions only drop their state, their files (uploads, edited annotation files and colored spreadsheets) are kept
+g_sessions = SessionStore(SESSION_TTL, new_session_state, SESSION_STORAGE_FOLDER)
+# Init cache of the loaded annotation files (brought up to date with their edit journals on each use)
+g_annotation_files = AnnotationFileCache(ANNOTATION_FILE_CACHE_MAX_SIZE)
+# Init background job queue (job statuses are shared with the other workers along with the session states)
+g_jobs = JobQueue(JOB_QUEUE_NUM_OF_WORKERS, SESSION_TTL, SESSION_STORAGE_FOLDER)
+
+def get_session_id():
+    ''' Return the id of the current session (stored in the signed session cookie), create one if needed '''
+
+    if 'sid' not in session:
+        session['sid'] = uuid4().hex
+    return session['sid']
+
+def get_session_state():
+    ''' Return the state of the current session '''
+
+    return g_sessions.get(get_session_id())
+
+def update_session_state():
+    ''' Return a context holding the state of the current session, stored once the context exits (see SessionStore.update) '''
+
+    return g_sessions.update(get_session_id())
+
+def get_active_annotations(state):
+    ''' Return the dictionary of annotations of the active annotation file of a session state (see AnnotationFileCache) '''
+
+    if state['active_filename'] == '' or not exists(state['active_filename']):
+        return dict()
+    return g_annotation_files.get(state['active_filename'])
+
+def get_session_storage_folder():
+    ''' Return the directory holding the work files of the current session (uploads are not shared between sessions) '''
+
+    folder = STORAGE_FOLDER + get_session_id() + '/'
+    if not exists(folder):
+        makedirs(folder)
+    return folder
+
+def get_session_job_status(job_id):
+    ''' Return the status of a background job of the current session, or None '''
+
+    status = g_jobs.get_status(job_id)
+    if status is None or status['owner'] != get_session_id():
+        return None
+    return status
+
+def extract_annotation_file(xlsx_fname, json_fname, file_format, progress_callback):
+    ''' Background job: process a spreadsheet file (xlsx) and write its annotation file (in file_format, see write_annotation_file) '''
+
+    ant_dict, _ = process_file(xlsx_fname, keep_raw_sheets=False, progress_callback=progress_callback)
+    write_annotation_file(ant_dict, json_fname, file_format)
+    return {'xlsx_fname': xlsx_fname, 'json_fname': json_fname}
+
+def apply_annotation_edit(state, edit):
+    ''' Apply an edit to the active annotation dictionary (see apply_edit), and journal it next to the active file '''
+
+    if state['active_filename'] == '':
+        raise KeyError('no active annotation file')
+    return g_annotation_files.apply_edit(state['active_filename'], edit)
+
+# --- pages -------------------------------------------------------------------
 
 @app.route("/")
 def welcome():
@@ -45,7 +144,7 @@ def parse():
     str_list = list()
     form = ParseForm()
     if form.validate_on_submit():
-        cu_list = ccut.get_all_ccu(form.u.data)
+        cu_list = get_ccut_instance().get_all_ccu(form.u.data)
         for cu in cu_list:
             str_list.append(dumps(cu, sort_keys=True, indent=4, separators=(',', ': ')))
 
@@ -55,119 +154,206 @@ def parse():
 def convert():
     ''' Page to handle Canonical Compound Unit Conversion '''
 
-    global g_conv_res, g_conv_src_idx, g_conv_dst_idx
-
     form = ConversionForm()
-    if form.validate_on_submit():
-        g_conv_src_idx = 1
-        g_conv_dst_idx = 1
-        src_ccu = ccut.get_all_ccu(form.in_unit.data)
-        src_str_list = list()
-        for cu in src_ccu:
-            src_str_list.append(dumps(cu, sort_keys=True, indent=4, separators=(',', ': ')))
-
-        dst_ccu = ccut.get_all_ccu(form.out_unit.data)
-        dst_str_list = list()
-        for cu in dst_ccu:
-            dst_str_list.append(dumps(cu, sort_keys=True, indent=4, separators=(',', ': ')))
-
-        g_conv_res = ccut.convert_ccu2ccu(src_ccu[g_conv_src_idx-1], dst_ccu[g_conv_dst_idx-1], float(form.in_val.data))
-        g_conv_res += (float(form.in_val.data), src_str_list, dst_str_list)
-        g_conv_res += (src_ccu, dst_ccu)
-    elif len(g_conv_res) != 0:
-        temp = g_conv_res
-        g_conv_res = ccut.convert_ccu2ccu(temp[6][g_conv_src_idx-1], temp[7][g_conv_dst_idx-1], temp[3])
-        g_conv_res += (temp[3], temp[4], temp[5], temp[6], temp[7])
-
-    return render_template('ccu_convert.html', form=form, result=g_conv_res,\
-                           src_idx=g_conv_src_idx, dst_idx=g_conv_dst_idx)
+    with update_session_state() as state:
+        if form.validate_on_submit():
+            state['conv_src_idx'] = 1
+            state['conv_dst_idx'] = 1
+            state['conv_units'] = (form.in_unit.data, form.out_unit.data)
+            src_ccu = get_all_ccu_cached(get_ccut_instance(), form.in_unit.data)
+            src_str_list = list()
+            for cu in src_ccu:
+                src_str_list.append(dumps(cu, sort_keys=True, indent=4, separators=(',', ': ')))
+
+            dst_ccu = get_all_ccu_cached(get_ccut_instance(), form.out_unit.data)
+            dst_str_list = list()
+            for cu in dst_ccu:
+                dst_str_list.append(dumps(cu, sort_keys=True, indent=4, separators=(',', ': ')))
+
+            plan = get_conversion_plan(get_ccut_instance(), state['conv_units'][0], state['conv_src_idx'], \
+                                       state['conv_units'][1], state['conv_dst_idx'])
+            conv_res = apply_conversion_plan(plan, float(form.in_val.data))
+            conv_res += (float(form.in_val.data), src_str_list, dst_str_list)
+            conv_res += (src_ccu, dst_ccu)
+            state['conv_res'] = conv_res
+        elif len(state['conv_res']) != 0:
+            # chosen representations changed (see update_convert), only the (cached) plan is needed
+            temp = state['conv_res']
+            plan = get_conversion_plan(get_ccut_instance(), state['conv_units'][0], state['conv_src_idx'], \
+                                       state['conv_units'][1], state['conv_dst_idx'])
+            conv_res = apply_conversion_plan(plan, temp[3])
+            conv_res += (temp[3], temp[4], temp[5], temp[6], temp[7])
+            state['conv_res'] = conv_res
+
+    return render_template('ccu_convert.html', form=form, result=state['conv_res'],\
+                           src_idx=state['conv_src_idx'], dst_idx=state['conv_dst_idx'])
 
 @app.route('/update_convert', methods=['GET'])
 def update_convert():
     ''' API to handle choosing radio-button options for conversion '''
 
-    global g_conv_src_idx, g_conv_dst_idx
-
     ARG_IN_OR_OUT = 'cu'
     ARG_IDX = 'i'
     if ARG_IN_OR_OUT in request.args and ARG_IDX in request.args:
-        if request.args.get(ARG_IN_OR_OUT) == 'in':
-            g_conv_src_idx = int(request.args.get(ARG_IDX))
-        else:
-            g_conv_dst_idx = int(request.args.get(ARG_IDX))
+        with update_session_state() as state:
+            if request.args.get(ARG_IN_OR_OUT) == 'in':
+                state['conv_src_idx'] = int(request.args.get(ARG_IDX))
+            else:
+                state['conv_dst_idx'] = int(request.args.get(ARG_IDX))
 
     return redirect(url_for('convert'))
 
+@app.route('/api/parse', methods=['POST'])
+def api_parse():
+    ''' JSON API to parse a batch of unit strings.
+    Expects {"units": [str, ...]}, returns {"results": [{"unit": str, "ccu": [...]} or {"unit": str, "error": str}, ...]}
+    in the order of the input (each distinct string is parsed once, other items are reported as "not a string"). '''
+
+    req = request.get_json(silent=True)
+    if not req or not isinstance(req.get('units'), list):
+        return jsonify({'error': 'expected a json object with a list of "units"'}), 400
+
+    parsed = dict()
+    for unit_str in req['units']:
+        if not isinstance(unit_str, str) or unit_str in parsed:
+            continue
+        try:
+            parsed[unit_str] = {'unit': unit_str, 'ccu': get_all_ccu_cached(get_ccut_instance(), unit_str)}
+        except Exception as e:
+            parsed[unit_str] = {'unit': unit_str, 'error': f'{type(e).__name__}: {e}'}
+
+    return jsonify({'results': [parsed[unit_str] if isinstance(unit_str, str) else {'unit': unit_str, 'error': 'not a string'} \
+                                for unit_str in req['units']]})
+
+@app.route('/api/convert', methods=['POST'])
+def api_convert():
+    ''' JSON API to convert a batch of values between units (using the top representation of each unit).
+    Expects {"conversions": [{"value": float, "src": str, "dst": str}, ...]}, returns
+    {"results": [{"value", "src", "dst", "result", "status", "status_msg"} or {..., "error": str}, ...]}
+    in the order of the input (each distinct unit pair is resolved once, see get_conversion_plan). '''
+
+    req = request.get_json(silent=True)
+    if not req or not isinstance(req.get('conversions'), list):
+        return jsonify({'error': 'expected a json object with a list of "conversions"'}), 400
+
+    results = list()
+    for conv in req['conversions']:
+        if not isinstance(conv, dict):
+            conv = dict()
+        try:
+            src_str, dst_str, val = str(conv['src']), str(conv['dst']), float(conv['value'])
+            conv_res = apply_conversion_plan(get_conversion_plan(get_ccut_instance(), src_str, 1, dst_str, 1), val)
+            results.append({'value': val, 'src': src_str, 'dst': dst_str, \
+                            'result': conv_res[0], 'status': conv_res[1], 'status_msg': conv_res[2]})
+        except Exception as e:
+            results.append({'value': conv.get('value'), 'src': conv.get('src'), 'dst': conv.get('dst'), \
+                            'error': f'{type(e).__name__}: {e}'})
+
+    return jsonify({'results': results})
+
+@app.route('/api/convert/stats', methods=['GET'])
+def api_convert_stats():
+    ''' JSON API returning the counters (hits, misses, evictions, hit rate) of the conversion caches '''
+
+    return jsonify(get_conversion_cache_stats())
+
 @app.route('/annotate', methods=['GET', 'POST'])
 def load_annotation_file():
     ''' Page to handle uploading annotation file (json). Redirects to editor-UI '''
 
-    global g_active_json, g_active_filename
-
     form = FileUploadForm()
     if form.validate_on_submit():
         f = form.in_file.data
         filename = secure_filename(f.filename)
-        if not exists(STORAGE_FOLDER):
-            makedirs(STORAGE_FOLDER)
-        g_active_filename = STORAGE_FOLDER + filename
-        f.save(g_active_filename)
-        with open(g_active_filename, 'r') as read_file_h:
-            g_active_json = load(read_file_h)
+        folder = get_session_storage_folder()
+        with update_session_state() as state:
+            state['active_filename'] = folder + filename
+            state['active_xlsx_fname'] = ''
+            f.save(state['active_filename'])
         return redirect(url_for('edit_annotation_file'))
     else:
         return render_template('file_upload.html', form=form, title='Upload annotation file', file_ext='.json')
 
 @app.route('/process_tables', methods=['GET', 'POST'])
 def process_spreadsheet_file():
-    ''' Page to handle processing excel file (xlsx). Creates json and redirects to editor-UI '''
-
-    global g_active_json, g_active_filename, g_active_xlsx_fname
+    ''' Page to handle processing excel file (xlsx). Enqueues an extraction job and redirects to its status page '''
 
-    form = FileUploadForm()
+    form = SpreadsheetUploadForm()
     if form.validate_on_submit():
         f = form.in_file.data
         filename = secure_filename(f.filename)
-        if not exists(STORAGE_FOLDER):
-            makedirs(STORAGE_FOLDER)
-        g_active_xlsx_fname = STORAGE_FOLDER + filename
-        f.save(g_active_xlsx_fname)
-        g_active_json, _ = process_file(g_active_xlsx_fname)
-        g_active_filename = '.'.join(g_active_xlsx_fname.split('.')[:-1]) + '.ccut.json'
-        with open(g_active_filename, 'w') as outfile:
-            dump(g_active_json, outfile, indent=2)
-
-        # TODO: color original xlsx
-        return redirect(url_for('edit_annotation_file'))
+        xlsx_fname = get_session_storage_folder() + filename
+        f.save(xlsx_fname)
+        json_fname = get_annotation_fname(xlsx_fname, form.out_format.data)
+        job_id = g_jobs.submit(extract_annotation_file, xlsx_fname, json_fname, form.out_format.data, owner=get_session_id())
+        return redirect(url_for('show_job_status', job_id=job_id))
     else:
         return render_template('file_upload.html', form=form, title='Process spreadsheet file', file_ext='.xlsx')
 
+@app.route('/jobs/<string:job_id>', methods=['GET'])
+def show_job_status(job_id):
+    ''' Page showing the progress of a background extraction job, moves to the editor-UI once it is done '''
+
+    status = get_session_job_status(job_id)
+    if status is None:
+        return render_template('generic.html', data='Unknown job'), 404
+
+    return render_template('job_status.html', job=status)
+
+@app.route('/jobs/<string:job_id>/open', methods=['GET'])
+def open_job_result(job_id):
+    ''' API to load the annotation file created by a (finished) extraction job. Redirects to editor-UI '''
+
+    status = get_session_job_status(job_id)
+    if status is None or status['status'] != JOB_DONE:
+        return redirect(url_for('show_job_status', job_id=job_id))
+
+    with update_session_state() as state:
+        state['active_xlsx_fname'] = status['result']['xlsx_fname']
+        state['active_filename'] = status['result']['json_fname']
+
+    # TODO: color original xlsx
+    return redirect(url_for('edit_annotation_file'))
+
+@app.route('/api/jobs/<string:job_id>', methods=['GET'])
+def api_job_status(job_id):
+    ''' JSON API returning the status of a background extraction job:
+    {"id", "status" (queued/running/done/failed), "progress": [steps done, steps], "message", "error", ...} '''
+
+    status = get_session_job_status(job_id)
+    if status is None:
+        return jsonify({'error': 'unknown job'}), 404
+
+    return jsonify(status)
+
 @app.route('/edit', methods=['GET', 'POST'])
 def edit_annotation_file():
     ''' Page holding the json editor-UI '''
 
-    global g_active_json, g_active_filename
-
-    init_flat_search_lists(g_active_json)
+    state = get_session_state()
     form = AnnotationEditForm()
-    if form.validate_on_submit():
-        add_annotation_to_cell(g_active_json, form.q_sheet.data, form.cell.data, \
-                               form.m.data, form.q_prefix.data, form.q_unit.data, form.e.data)
-        update_cell_dimension(g_active_json, form.q_sheet.data, form.cell.data)
+    if form.validate_on_submit() and state['active_filename'] != '':
+        try:
+            apply_annotation_edit(state, {'op': EDIT_ADD, 'sheet': form.q_sheet.data, 'cell': form.cell.data, \
+                                          'm': form.m.data, 'p': form.q_prefix.data, 'u': form.q_unit.data, 'e': form.e.data})
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            return render_template('generic.html', data=f'Invalid annotation ({e})'), 400
 
-    return render_template('ccu_json_edit.html', ant_dict=g_active_json, fname=g_active_filename, form=form)
+    # cells are fetched (and patched) by page, see api_annotations
+    return render_template('ccu_json_edit.html', sheets=list(get_active_annotations(state).keys()), \
+                           fname=state['active_filename'], form=form, page_size=ANNOTATION_PAGE_SIZE)
 
 @app.route('/save')
 def save_annotation_file():
-    ''' API to save the json annotation file '''
-
-    global g_active_json, g_active_filename, g_active_xlsx_fname
+    ''' API to save the json annotation file.
+    Edits are journaled as they are made (see EditJournal), the file is rewritten once the journal grows large '''
 
-    if g_active_filename != "":
-        with open(g_active_filename, 'w') as outfile:
-            dump(g_active_json, outfile, indent=2)
-        if g_active_xlsx_fname != "":
-            colorize_spreadsheet(g_active_json, g_active_xlsx_fname)
+    state = get_session_state()
+    if state['active_filename'] != "":
+        g_annotation_files.compact(state['active_filename'], EDIT_JOURNAL_COMPACT_SIZE)
+        if state['active_xlsx_fname'] != "":
+            overlay_fname = '.'.join(state['active_xlsx_fname'].split('.')[:-1]) + '.ccut_overlay.xlsx' if SPREADSHEET_OVERLAY else None
+            colorize_spreadsheet(get_active_annotations(state), state['active_xlsx_fname'], overlay_fname)
 
     return redirect(url_for('edit_annotation_file'))
 
@@ -175,38 +361,83 @@ def save_annotation_file():
 def remove_element_in_annotation_file():
     ''' API to remove an element (unit-part, cell or sheet) from annotation dictionary '''
 
-    global g_active_json
-
     ARG_SHEET = 's'
     ARG_COL = 'c'
     ARG_ROW = 'r'
     ARG_IDX = 'i' # part index in cell
     if ARG_SHEET in request.args:
-        sheet = request.args.get(ARG_SHEET)
-        if ARG_COL in request.args:
-            col = request.args.get(ARG_COL)
-            if ARG_ROW in request.args:
-                row = request.args.get(ARG_ROW)
-                if ARG_IDX in request.args:
-                    idx = request.args.get(ARG_IDX)
-                    del g_active_json[sheet][col][row][0]['parts'][int(idx)-1]
-                    update_cell_dimension(g_active_json, sheet, col+row)
-                    # if there are more unit-parts in cell, return
-                    if len(g_active_json[sheet][col][row][0]['parts']) != 0:
-                        return redirect(url_for('edit_annotation_file'))
-                    # otherwise, continute to remove row (cell)
-                del g_active_json[sheet][col][row]
-                # if there are no more rows in col, delete col
-                if len(g_active_json[sheet][col]) == 0:
-                    del g_active_json[sheet][col]
-                # if there are more cols in sheet, return
-                if len(g_active_json[sheet]) != 0:
-                    return redirect(url_for('edit_annotation_file'))
-                # otherwise, continute to remove sheet
-        del g_active_json[sheet]
+        state = get_session_state()
+        try:
+            apply_annotation_edit(state, {'op': EDIT_REMOVE, 'sheet': request.args.get(ARG_SHEET), 'column': request.args.get(ARG_COL), \
+                                          'row': request.args.get(ARG_ROW), 'index': request.args.get(ARG_IDX)})
+        except (KeyError, IndexError, TypeError, ValueError):
+            return render_template('generic.html', data='No such element'), 404
 
     return redirect(url_for('edit_annotation_file'))
 
+@app.route('/api/annotations', methods=['GET'])
+def api_annotations():
+    ''' JSON API serving a page of the cells of a sheet in the active annotation dictionary.
+    Arguments: s (sheet, default: first sheet), c (column, default: all), q (filter, see match_cell_annotation),
+    page (1-based) and page_size. Returns the page (see get_annotation_page) along with the file's sheets. '''
+
+    state = get_session_state()
+    ant_dict = get_active_annotations(state)
+    sheet = request.args.get('s', next(iter(ant_dict), ''))
+    page_size = min(max(request.args.get('page_size', ANNOTATION_PAGE_SIZE, type=int), 1), ANNOTATION_MAX_PAGE_SIZE)
+    page = get_annotation_page(ant_dict, sheet, request.args.get('c') or None, request.args.get('q') or None, \
+                               request.args.get('page', 1, type=int), page_size)
+    page['sheets'] = list(ant_dict.keys())
+    page['fname'] = state['active_filename']
+
+    return jsonify(page)
+
+@app.route('/api/annotations/add', methods=['POST'])
+def api_add_annotation():
+    ''' JSON API to add a unit-part to a cell of the active annotation dictionary.
+    Expects {"sheet", "cell" (i.e., "A15"), "u" (unit), "p" (prefix), "m" (multiplier), "e" (exponent)},
+    returns the changed cell as {"sheet", "column", "row", "cell"} (with its recomputed dimension). '''
+
+    req = request.get_json(silent=True)
+    if not req or not req.get('sheet') or not req.get('u') or not fullmatch(r'[A-Za-z]+[0-9]+', str(req.get('cell', ''))):
+        return jsonify({'error': 'expected a json object with a "sheet", a "cell" (i.e., "A15") and a unit ("u")'}), 400
+
+    state = get_session_state()
+    if state['active_filename'] == '':
+        return jsonify({'error': 'no active annotation file'}), 404
+    sheet = str(req['sheet'])
+    try:
+        apply_annotation_edit(state, {'op': EDIT_ADD, 'sheet': sheet, 'cell': req['cell'], 'm': str(req.get('m', '')), \
+                                      'p': str(req.get('p', '')), 'u': str(req['u']), 'e': str(req.get('e', ''))})
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        # i.e., a non-numeric exponent, nothing was changed (see check_edit)
+        return jsonify({'error': f'invalid annotation ({e})'}), 400
+    ant_dict = get_active_annotations(state)
+
+    col, row = get_column_row_from_cell_string(req['cell'])
+    return jsonify({'sheet': sheet, 'column': col, 'row': row, 'cell': ant_dict[sheet][col][row]})
+
+@app.route('/api/annotations/remove', methods=['POST'])
+def api_remove_annotation():
+    ''' JSON API to remove an element (unit-part, cell or sheet) from the active annotation dictionary.
+    Expects {"sheet", "column", "row", "index" (1-based part index)} (the last ones are optional, see remove_annotation),
+    returns {"sheet", "column", "row", "removed" (part, cell or sheet), "cell" (the changed cell, if it was kept)}. '''
+
+    req = request.get_json(silent=True)
+    if not req or 'sheet' not in req:
+        return jsonify({'error': 'expected a json object with a "sheet"'}), 400
+
+    state = get_session_state()
+    sheet, col, row, idx = req['sheet'], req.get('column'), req.get('row'), req.get('index')
+    try:
+        removed = apply_annotation_edit(state, {'op': EDIT_REMOVE, 'sheet': sheet, 'column': col, 'row': row, 'index': idx})
+    except (KeyError, IndexError, TypeError, ValueError):
+        return jsonify({'error': 'no such element'}), 404
+    ant_dict = get_active_annotations(state)
+
+    return jsonify({'sheet': sheet, 'column': col, 'row': row, 'removed': removed, \
+                    'cell': ant_dict[sheet][col][row] if removed == 'part' else None})
+
 @app.route("/edit/<string:box>")
 def process(box):
     ''' API to get auto-complete suggestions for a given text box '''
@@ -214,7 +445,7 @@ def process(box):
     query = request.args.get('query')
     suggestions = list()
     if box == 'q_sheet':
-        suggest_list = fuzzy_search_sheet(query)
+        suggest_list = fuzzy_search_sheet(query, get_active_annotations(get_session_state()))
     if box == 'q_prefix':
         suggest_list = fuzzy_search_prefix(query)
     if box == 'q_unit':
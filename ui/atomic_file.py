@@ -0,0 +1,44 @@
+from contextlib import contextmanager
+from fcntl import flock, LOCK_EX, LOCK_UN
+from os import fsync, remove, replace
+from uuid import uuid4
+
+@contextmanager
+def atomic_open(fname, mode='w', sync=False):
+    ''' Open a file for writing at once (as a context manager yielding the file object): it is written to a uniquely
+    named temporary file next to it, which is renamed over it on exit (and removed on error), so readers (or a crash)
+    see either the old or the new file, and concurrent writers never mix their contents.
+    If sync, the file is on disk once this returns. '''
+
+    tmp_fname = f'{fname}.{uuid4().hex}.tmp'
+    try:
+        with open(tmp_fname, mode) as outfile:
+            yield outfile
+            if sync:
+                outfile.flush()
+                fsync(outfile.fileno())
+        replace(tmp_fname, fname)
+    except BaseException:
+        try:
+            remove(tmp_fname)
+        except OSError:
+            pass
+        raise
+
+def atomic_write(fname, data, sync=False):
+    ''' Write data (bytes or a string) to a file at once (see atomic_open). '''
+
+    with atomic_open(fname, 'wb' if isinstance(data, bytes) else 'w', sync) as outfile:
+        outfile.write(data)
+
+@contextmanager
+def file_lock(lock_fname):
+    ''' Hold an exclusive lock on a (lock) file (created if needed) while in the context, excluding other processes
+    and other threads locking the same file. The lock is advisory, it only excludes the others holding it. '''
+
+    with open(lock_fname, 'a') as lock_file:
+        flock(lock_file.fileno(), LOCK_EX)
+        try:
+            yield
+        finally:
+            flock(lock_file.fileno(), LOCK_UN)
@@ -0,0 +1,251 @@
+from annotate import get_unit_options, NUM_RESULTS_TO_SUGGEST
+from argparse import ArgumentParser
+from baselutils import fclrprint
+from ccut_sheets import init_globals, process_file, process_cell, get_cell_cache_stats
+from ccut_sheets_validator import init_ccut_validation, compare_actual_with_expected_dicts
+from fuzzy_index import FuzzyIndex
+from fuzzywuzzy.process import extract
+from json import dump, dumps
+from openpyxl import Workbook
+from os import close, remove
+from os.path import basename
+from random import Random
+from resource import getrusage, RUSAGE_SELF
+from statistics import mean, median
+from string import ascii_lowercase
+from sys import platform
+from tempfile import mkstemp
+from time import perf_counter
+
+# units repeated all over a typical spreadsheet
+COMMON_UNIT_STRINGS = ['mg/L', 'kg m-2 s-1', 'Temperature (C)', 'km', 'm/s', 'ppm', 'W m-2', 'mol/L', 'hPa', 'degC']
+# building blocks for generating (mostly) distinct unit strings
+SYNTH_PREFIXES = ['', 'k', 'm', 'M', 'c', 'n', 'G']
+SYNTH_UNITS = ['g', 'm', 's', 'L', 'W', 'J', 'Pa', 'N', 'mol', 'A', 'V', 'K', 'Hz']
+SYNTH_EXPONENTS = ['', '-1', '2', '-2', '3', '-3']
+
+# --- entrypoint --------------------------------------------------------------
+
+def main():
+    ap = ArgumentParser(description=f'Benchmark the spreadsheet extraction pipeline over synthetic workbooks (xlsx).\n\tUSAGE: python {basename(__file__)} -r ROWS -s SHEETS')
+    ap.add_argument('-r', '--rows', help='number of rows per sheet (default: 1000).', type=int, default=1000)
+    ap.add_argument('-c', '--columns', help='number of columns per sheet (default: 10).', type=int, default=10)
+    ap.add_argument('-s', '--sheets', help='number of sheets (default: 2).', type=int, default=2)
+    ap.add_argument('-u', '--unit_density', help='fraction of body cells holding a unit string (default: 0.01).', type=float, default=0.01)
+    ap.add_argument('-p', '--duplication', help='fraction of unit strings drawn from a small pool of common units (default: 0.9).', type=float, default=0.9)
+    ap.add_argument('-n', '--repeat', help='number of runs, the best time of each stage is reported (default: 1).', type=int, default=1)
+    ap.add_argument('--seed', help='random seed (default: 0).', type=int, default=0)
+    ap.add_argument('-a', '--autocomplete', help='Benchmark the unit auto-complete search (index vs. full scan) instead.', \
+                    default=False, action='store_true')
+    ap.add_argument('-q', '--queries', help='number of auto-complete queries (default: 200).', type=int, default=200)
+    ap.add_argument('-o', '--output_file', help='If specified, write the results to this file (json).', type=str)
+    args = ap.parse_args()
+
+    if args.autocomplete:
+        results = run_autocomplete_benchmark(args.queries, args.seed)
+    else:
+        results = run_benchmark(args.rows, args.columns, args.sheets, args.unit_density, args.duplication, \
+                                args.repeat, args.seed)
+    if args.output_file:
+        with open(args.output_file, 'w') as outfile:
+            dump(results, outfile, indent=2)
+        fclrprint(f'Done... generated file {args.output_file}', 'g')
+    else:
+        print(dumps(results, indent=2))
+
+# --- workbook generation -----------------------------------------------------
+
+def generate_unit_string(rnd, duplication):
+    ''' Return a unit string, either a common one (with probability duplication) or a generated compound unit. '''
+
+    if rnd.random() < duplication:
+        return rnd.choice(COMMON_UNIT_STRINGS)
+    parts = list()
+    for _ in range(rnd.randint(1, 3)):
+        parts.append(rnd.choice(SYNTH_PREFIXES) + rnd.choice(SYNTH_UNITS) + rnd.choice(SYNTH_EXPONENTS))
+    return ' '.join(parts)
+
+def generate_workbook(fname, num_of_rows, num_of_cols, num_of_sheets, unit_density, duplication, seed):
+    ''' Write a synthetic workbook: a header row of unit strings over a numeric body
+    in which a unit_density fraction of the cells hold unit strings. '''
+
+    rnd = Random(seed)
+    workbook = Workbook(write_only=True)
+    for sheet_idx in range(num_of_sheets):
+        worksheet = workbook.create_sheet(f'Sheet{sheet_idx+1}')
+        worksheet.append([generate_unit_string(rnd, duplication) for _ in range(num_of_cols)])
+        for _ in range(num_of_rows - 1):
+            worksheet.append([generate_unit_string(rnd, duplication) if rnd.random() < unit_density \
+                              else round(rnd.uniform(-1000, 1000), 3) for _ in range(num_of_cols)])
+    workbook.save(fname)
+
+# --- measurement -------------------------------------------------------------
+
+def get_peak_rss_mb():
+    ''' Return the peak resident set size of this process (MB). '''
+
+    # ru_maxrss is given in bytes on macOS, in kilobytes elsewhere
+    peak_rss = getrusage(RUSAGE_SELF).ru_maxrss
+    return peak_rss / (1024.0 * 1024.0) if platform == 'darwin' else peak_rss / 1024.0
+
+def time_pipeline_stages(fname):
+    ''' Run process_file over a file (with cold parse caches), return a dictionary of its stage timings (seconds,
+    as reported by process_file, see return_stats) along with the file's annotation dictionary and its cell counts. '''
+
+    init_globals()
+    f_dict, _, stats = process_file(fname, keep_raw_sheets=False, return_stats=True)
+    timings = {'load': stats['seconds']['load'], 'filter': stats['seconds']['filter'],
+               'ccut_parse': stats['seconds']['parse'], 'post_process': stats['seconds']['post_process']}
+
+    start = perf_counter()
+    dumps(f_dict, indent=2)
+    timings['json_dump'] = perf_counter() - start
+
+    counts = {'cells': stats['cells']['seen'], 'candidate_cells': stats['cells']['candidates'],
+              'distinct_strings': stats['cells']['distinct_strings']}
+    return timings, f_dict or dict(), counts
+
+def time_process_cell(cell_strs):
+    ''' Time process_cell over a list of (distinct) cell strings, with a cold cache and then with a warm one,
+    return seconds per call of each. '''
+
+    init_globals()
+    start = perf_counter()
+    for cell_str in cell_strs:
+        process_cell(cell_str)
+    cold_seconds = (perf_counter() - start) / max(len(cell_strs), 1)
+    start = perf_counter()
+    for cell_str in cell_strs:
+        process_cell(cell_str)
+    return cold_seconds, (perf_counter() - start) / max(len(cell_strs), 1)
+
+def get_distinct_unit_strings(rnd, num_of_strs):
+    ''' Return a list of (up to num_of_strs) distinct generated unit strings. '''
+
+    cell_strs = dict()
+    for _ in range(10 * num_of_strs):
+        if len(cell_strs) == num_of_strs:
+            break
+        cell_strs[generate_unit_string(rnd, 0.0)] = None
+    return list(cell_strs)
+
+def time_validator_comparison(f_dict):
+    ''' Time compare_actual_with_expected_dicts of an annotation dictionary against itself, return seconds. '''
+
+    init_ccut_validation()
+    start = perf_counter()
+    compare_actual_with_expected_dicts(f_dict, f_dict)
+    return perf_counter() - start
+
+def run_benchmark(num_of_rows, num_of_cols, num_of_sheets, unit_density, duplication, repeat, seed):
+    ''' Generate a synthetic workbook, time the pipeline stages over it and return the results (dict). '''
+
+    results = {'config': {'rows': num_of_rows, 'columns': num_of_cols, 'sheets': num_of_sheets,
+                          'unit_density': unit_density, 'duplication': duplication, 'repeat': repeat, 'seed': seed}}
+
+    fd, fname = mkstemp(suffix='.xlsx')
+    close(fd)
+    try:
+        start = perf_counter()
+        generate_workbook(fname, num_of_rows, num_of_cols, num_of_sheets, unit_density, duplication, seed)
+        results['generate_seconds'] = perf_counter() - start
+
+        # warm-up: load CCUT's symbol and dimension maps once, outside of the timed stages
+        start = perf_counter()
+        init_globals()
+        process_cell('m')
+        results['ccut_init_seconds'] = perf_counter() - start
+
+        best = dict()
+        for _ in range(repeat):
+            timings, f_dict, counts = time_pipeline_stages(fname)
+            for stage, seconds in timings.items():
+                best[stage] = min(seconds, best.get(stage, seconds))
+        results['stages_seconds'] = best
+        results['total_seconds'] = sum(best.values())
+        results['counts'] = counts
+        results['cells_per_second'] = counts['cells'] / results['total_seconds'] if results['total_seconds'] else 0.0
+        results['cache'] = get_cell_cache_stats()
+
+        # distinct strings, so that every call of the cold pass reaches CCUT
+        cell_strs = get_distinct_unit_strings(Random(seed), max(counts['distinct_strings'], 1))
+        results['process_cell_seconds_per_call'], results['process_cell_cached_seconds_per_call'] = time_process_cell(cell_strs)
+        results['validator_compare_seconds'] = time_validator_comparison(f_dict)
+        results['peak_rss_mb'] = get_peak_rss_mb()
+    finally:
+        remove(fname)
+
+    return results
+
+# --- auto-complete -----------------------------------------------------------
+
+def generate_autocomplete_query(rnd, choices):
+    ''' Return a query as typed in an auto-complete box: a prefix, a fragment or a misspelling of a choice. '''
+
+    choice = rnd.choice(choices)
+    kind = rnd.random()
+    if kind < 0.4:
+        return choice[:rnd.randint(min(3, len(choice)), len(choice))]
+    if kind < 0.7:
+        start = rnd.randint(0, max(len(choice) - 3, 0))
+        return choice[start:start+rnd.randint(3, 8)]
+    chars = list(choice.lower())
+    for _ in range(rnd.randint(1, 2)):
+        chars[rnd.randrange(len(chars))] = rnd.choice(ascii_lowercase)
+    return ''.join(chars)
+
+def summarize_latencies(latencies):
+    ''' Return the mean/median/p95/max of a list of latencies (seconds), in milliseconds. '''
+
+    latencies = sorted(latencies)
+    return {'mean_ms': 1000 * mean(latencies), 'median_ms': 1000 * median(latencies),
+            'p95_ms': 1000 * latencies[int(0.95 * (len(latencies) - 1))], 'max_ms': 1000 * latencies[-1]}
+
+def run_autocomplete_benchmark(num_of_queries, seed):
+    ''' Time the unit auto-complete search with the character index (FuzzyIndex) against fuzzywuzzy's full scan
+    over generated queries, return the latencies, how often both agree and the queries they disagree on (dict). '''
+
+    start = perf_counter()
+    unit_options = get_unit_options()
+    results = {'config': {'queries': num_of_queries, 'seed': seed, 'limit': NUM_RESULTS_TO_SUGGEST,
+                          'choices': len(unit_options)},
+               'init_seconds': perf_counter() - start}
+
+    start = perf_counter()
+    index = FuzzyIndex(unit_options)
+    results['index_build_seconds'] = perf_counter() - start
+
+    rnd = Random(seed)
+    # sorted, so that a seed always generates the same queries
+    query_units = sorted(unit for unit in unit_options if unit)
+    queries = [generate_autocomplete_query(rnd, query_units) for _ in range(num_of_queries)]
+    full_latencies, index_latencies = list(), list()
+    same_results, same_scores, same_top = 0, 0, 0
+    mismatches = list() # queries the index answers differently than the full scan
+    for query in queries:
+        start = perf_counter()
+        full_res = extract(query, unit_options, limit=NUM_RESULTS_TO_SUGGEST)
+        full_latencies.append(perf_counter() - start)
+        start = perf_counter()
+        index_res = index.search(query, NUM_RESULTS_TO_SUGGEST)
+        index_latencies.append(perf_counter() - start)
+        same_results += (full_res == index_res)
+        same_scores += ([score for _, score in full_res] == [score for _, score in index_res])
+        same_top += (full_res[:1] == index_res[:1])
+        if full_res != index_res:
+            mismatches.append({'query': query, 'full_scan': full_res, 'index': index_res})
+
+    results['full_scan'] = summarize_latencies(full_latencies)
+    results['index'] = summarize_latencies(index_latencies)
+    results['speedup'] = sum(full_latencies) / sum(index_latencies) if sum(index_latencies) else 0.0
+    results['agreement'] = {'same_results': float(same_results) / len(queries),
+                            'same_scores': float(same_scores) / len(queries),
+                            'same_top_result': float(same_top) / len(queries)}
+    # the index is expected to return exactly the results of the full scan
+    results['mismatches'] = mismatches
+    if mismatches:
+        fclrprint(f'The index results differ from the full scan ones on {len(mismatches)}/{len(queries)} queries', 'r')
+    return results
+
+if __name__ == '__main__':
+    main()
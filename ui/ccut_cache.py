@@ -0,0 +1,270 @@
+from atomic_file import atomic_open
+from baselutils import fclrprint
+from ccut.main.config import Config
+from ccut.main.dimension_map import DimensionMap
+from ccut.main.qudt_unit import QudtUnit
+from ccut.main.symbol_map import SymbolMap
+from collections import OrderedDict
+from hashlib import sha1
+from importlib.metadata import version, PackageNotFoundError
+from json import dumps, load, loads
+from os import getuid, listdir, makedirs, stat
+from os.path import exists, isfile, join
+from rdflib.term import URIRef
+from sqlite3 import connect, OperationalError
+from threading import Lock
+
+# sentinel returned on lookups of missing keys (None is a valid cached value)
+CACHE_MISS = object()
+# number of pending writes after which the persistent cache is committed to disk
+PERSISTENT_CACHE_COMMIT_EVERY = 500
+
+# --- fingerprint -------------------------------------------------------------
+
+def get_ccut_fingerprint():
+    ''' Return a fingerprint of the installed CCUT (package version and its symbol/dimension data files).
+    Parse results are only valid for the fingerprint they were computed with. '''
+
+    hsh = sha1()
+    try:
+        hsh.update(version('ccut').encode('utf-8'))
+    except PackageNotFoundError:
+        hsh.update(b'unknown')
+    for fname in sorted(listdir(Config.DATA_DIR)):
+        full_fname = join(Config.DATA_DIR, fname)
+        if isfile(full_fname):
+            hsh.update(fname.encode('utf-8'))
+            with open(full_fname, 'rb') as read_file:
+                hsh.update(read_file.read())
+    return hsh.hexdigest()
+
+# --- warm start --------------------------------------------------------------
+
+def encode_map_value(value, units):
+    ''' Return a json-compatible encoding of a value of CCUT's maps: dictionaries, tuples and units are tagged,
+    units (QudtUnit, shared between the maps) are encoded once, in units (id -> [index, unit]). '''
+
+    if isinstance(value, QudtUnit):
+        if id(value) not in units:
+            units[id(value)] = [len(units), value]
+        return {'unit': units[id(value)][0]}
+    if isinstance(value, URIRef):
+        return {'uri': str(value)}
+    if isinstance(value, dict):
+        if not all(isinstance(key, str) for key in value):
+            raise TypeError('Maps must have string keys')
+        return {'dict': {key: encode_map_value(val, units) for key, val in value.items()}}
+    if isinstance(value, tuple):
+        return {'tuple': [encode_map_value(val, units) for val in value]}
+    if isinstance(value, list):
+        return [encode_map_value(val, units) for val in value]
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    raise TypeError(f'Cannot encode a {type(value).__name__} of CCUT\'s maps')
+
+def decode_map_value(value, units):
+    ''' Return the value of CCUT's maps encoded by encode_map_value (units: index -> QudtUnit). '''
+
+    if isinstance(value, list):
+        return [decode_map_value(val, units) for val in value]
+    if not isinstance(value, dict):
+        return value
+    if 'unit' in value:
+        return units[value['unit']]
+    if 'uri' in value:
+        return URIRef(value['uri'])
+    if 'dict' in value:
+        return {key: decode_map_value(val, units) for key, val in value['dict'].items()}
+    return tuple(decode_map_value(val, units) for val in value['tuple'])
+
+def encode_ccut_maps(fingerprint):
+    ''' Return a json snapshot of CCUT's (loaded) symbol and dimension maps (the attributes of their instances). '''
+
+    units = dict()
+    maps = {'symbol_map': encode_map_value(vars(SymbolMap.get_instance()), units),
+            'dimension_map': encode_map_value(vars(DimensionMap.get_instance()), units)}
+    maps['units'] = [encode_map_value(vars(unit), units) for _, unit in sorted(units.values(), key=lambda itm: itm[0])]
+    maps['fingerprint'] = fingerprint
+    return dumps(maps)
+
+def decode_ccut_maps(snapshot):
+    ''' Set CCUT's symbol and dimension map instances from a (decoded json) snapshot of encode_ccut_maps. '''
+
+    units = list()
+    for unit_attrs in snapshot['units']:
+        unit = QudtUnit()
+        vars(unit).update(decode_map_value(unit_attrs, units))
+        units.append(unit)
+    symbol_map, dimension_map = SymbolMap.__new__(SymbolMap), DimensionMap.__new__(DimensionMap)
+    vars(symbol_map).update(decode_map_value(snapshot['symbol_map'], units))
+    vars(dimension_map).update(decode_map_value(snapshot['dimension_map'], units))
+    SymbolMap.instance, DimensionMap.instance = symbol_map, dimension_map
+
+def make_private_dir(dname):
+    ''' Create a directory only the current user may access (0700), if needed.
+    Return whether it is private: owned by the current user and not accessible to others. '''
+
+    makedirs(dname, mode=0o700, exist_ok=True)
+    dir_stat = stat(dname)
+    return dir_stat.st_uid == getuid() and not (dir_stat.st_mode & 0o077)
+
+def load_ccut_maps(snapshot_fname=None):
+    ''' Load CCUT's symbol and dimension maps (singletons, built from its data files on first use) once.
+    If snapshot_fname is given, the maps are read from this (json) file when it matches the installed CCUT
+    (see get_ccut_fingerprint), otherwise they are built and saved to it for the next run. '''
+
+    loaded = SymbolMap.instance is not None and DimensionMap.instance is not None
+    if loaded and (not snapshot_fname or exists(snapshot_fname)):
+        return
+
+    fingerprint = get_ccut_fingerprint() if snapshot_fname else None
+    if not loaded and snapshot_fname and exists(snapshot_fname):
+        try:
+            with open(snapshot_fname, 'r') as read_file:
+                snapshot = load(read_file)
+            if snapshot['fingerprint'] == fingerprint:
+                decode_ccut_maps(snapshot)
+                return
+        except Exception:
+            pass # unreadable (or stale) snapshot, rebuild it
+
+    SymbolMap.get_instance()
+    DimensionMap.get_instance()
+    if snapshot_fname:
+        try:
+            snapshot = encode_ccut_maps(fingerprint)
+        except TypeError as e:
+            fclrprint(f'Could not snapshot CCUT\'s maps ({e})', 'r')
+            return
+        with atomic_open(snapshot_fname, 'w') as outfile:
+            outfile.write(snapshot)
+
+# --- in-memory cache ---------------------------------------------------------
+
+class LRUCache:
+    ''' A bounded dictionary evicting the least-recently-used key once full (safe to share between threads).
+    Keeps hit/miss/eviction counters (see get_stats). '''
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key, default=None):
+        ''' Return the value stored for key (and mark it as recently used), or default. '''
+
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        ''' Store value for key, evicting the least-recently-used entry if needed. '''
+
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+            self.items[key] = value
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        ''' Drop all entries (counters are kept). '''
+
+        with self.lock:
+            self.items.clear()
+
+    def get_stats(self):
+        ''' Return a dictionary of the cache counters. '''
+
+        lookups = self.hits + self.misses
+        return {'size': len(self.items), 'max_size': self.max_size,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': (float(self.hits) / lookups) if lookups else 0.0}
+
+# --- on-disk cache -----------------------------------------------------------
+
+class PersistentCache:
+    ''' A key/value cache stored in a local SQLite file, values are stored as json.
+    The file is tagged with a fingerprint, opening it with a different fingerprint drops all entries.
+    Several processes may share the file: it is kept in WAL mode (readers do not wait for writers), and writes
+    are buffered in memory and committed in a single short transaction (see flush), so the write lock is not
+    held while parsing. '''
+
+    def __init__(self, fname, fingerprint):
+        self.fname = fname
+        self.hits = 0
+        self.misses = 0
+        self.pending = dict() # key -> json value, written on flush
+        self.conn = connect(fname, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT)')
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+        if row is None or row[0] != fingerprint:
+            # symbol tables changed (or new file), invalidate everything
+            self.conn.execute('DELETE FROM entries')
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('fingerprint', ?)", (fingerprint,))
+        self.conn.commit()
+
+    def get(self, key, default=None):
+        ''' Return the value stored for key, or default. '''
+
+        if key in self.pending:
+            self.hits += 1
+            return loads(self.pending[key])
+        try:
+            row = self.conn.execute('SELECT value FROM entries WHERE key = ?', (key,)).fetchone()
+        except OperationalError as e:
+            # i.e., locked by another process, treat as a miss
+            fclrprint(f'Could not read from cache file {self.fname} ({e})', 'r')
+            row = None
+        if row is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return loads(row[0])
+
+    def put(self, key, value):
+        ''' Store value for key (written to disk every PERSISTENT_CACHE_COMMIT_EVERY writes, see flush). '''
+
+        self.pending[key] = dumps(value)
+        if len(self.pending) >= PERSISTENT_CACHE_COMMIT_EVERY:
+            self.flush()
+
+    def flush(self):
+        ''' Write pending entries to disk, in a single transaction.
+        The cache is an optimization, a failed write (i.e., the file is locked by another process) is reported and skipped. '''
+
+        if not self.pending:
+            return
+        try:
+            with self.conn:
+                self.conn.executemany('INSERT OR REPLACE INTO entries (key, value) VALUES (?, ?)', self.pending.items())
+        except OperationalError as e:
+            fclrprint(f'Could not write {len(self.pending)} entries to cache file {self.fname} ({e})', 'r')
+        self.pending.clear()
+
+    def close(self):
+        ''' Commit pending writes and close the file. '''
+
+        self.flush()
+        self.conn.close()
+
+    def get_stats(self):
+        ''' Return a dictionary of the cache counters. '''
+
+        return {'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,69 @@
+from ccut import RET_VAL_OK
+from ccut_cache import LRUCache, CACHE_MISS
+from copy import deepcopy
+
+# number of distinct unit strings whose CCU representations are kept
+CCU_CACHE_MAX_SIZE = 4096
+# number of compiled (source, destination) conversion plans kept
+CONVERSION_PLAN_CACHE_MAX_SIZE = 4096
+
+# cache of unit string -> list of CCU representations (as returned by ccut.get_all_ccu)
+ccu_cache = LRUCache(CCU_CACHE_MAX_SIZE)
+# cache of (src string, src index, dst string, dst index) -> conversion plan
+conversion_plan_cache = LRUCache(CONVERSION_PLAN_CACHE_MAX_SIZE)
+
+def get_all_ccu_cached(ccut_inst, unit_str):
+    ''' Return the list of CCU representations of a unit string (parsed once, then served from cache).
+    The returned list is shared, it must not be altered (see compile_conversion_plan). '''
+
+    global ccu_cache
+
+    ccu_list = ccu_cache.get(unit_str, CACHE_MISS)
+    if ccu_list is CACHE_MISS:
+        ccu_list = ccut_inst.get_all_ccu(unit_str)
+        ccu_cache.put(unit_str, ccu_list)
+    return ccu_list
+
+def compile_conversion_plan(ccut_inst, src_ccu, dst_ccu):
+    ''' Resolve the conversion between two CCU representations to a single factor and offset
+    (CCUT conversions are affine: dst_value = factor * src_value + offset).
+    Returns a plan dictionary with 'factor', 'offset', 'status' and 'status_msg' (as in ccut.convert_ccu2ccu). '''
+
+    # convert_ccu2ccu alters the given representations, hand it copies
+    offset, sts, sts_str = ccut_inst.convert_ccu2ccu(deepcopy(src_ccu), deepcopy(dst_ccu), 0.0)
+    if sts != RET_VAL_OK:
+        return {'factor': 0.0, 'offset': 0.0, 'status': sts, 'status_msg': sts_str}
+    unit_val, sts, sts_str = ccut_inst.convert_ccu2ccu(deepcopy(src_ccu), deepcopy(dst_ccu), 1.0)
+    if sts != RET_VAL_OK:
+        return {'factor': 0.0, 'offset': 0.0, 'status': sts, 'status_msg': sts_str}
+    return {'factor': unit_val - offset, 'offset': offset, 'status': sts, 'status_msg': sts_str}
+
+def apply_conversion_plan(plan, value):
+    ''' Convert a value (or a NumPy array of values) with a compiled conversion plan.
+    Returns a (converted value, status, status message) tuple as in ccut.convert_ccu2ccu. '''
+
+    if plan['status'] != RET_VAL_OK:
+        return 0.0 * value, plan['status'], plan['status_msg']
+    return plan['factor'] * value + plan['offset'], plan['status'], plan['status_msg']
+
+def get_conversion_plan(ccut_inst, src_str, src_idx, dst_str, dst_idx):
+    ''' Return the conversion plan between the src_idx-th representation of src_str and the
+    dst_idx-th representation of dst_str (1-based indices, as in the UI), compiled once, then served from cache. '''
+
+    global conversion_plan_cache
+
+    key = (src_str, src_idx, dst_str, dst_idx)
+    plan = conversion_plan_cache.get(key, CACHE_MISS)
+    if plan is CACHE_MISS:
+        src_ccu = get_all_ccu_cached(ccut_inst, src_str)[src_idx-1]
+        dst_ccu = get_all_ccu_cached(ccut_inst, dst_str)[dst_idx-1]
+        plan = compile_conversion_plan(ccut_inst, src_ccu, dst_ccu)
+        conversion_plan_cache.put(key, plan)
+    return plan
+
+def get_conversion_cache_stats():
+    ''' Return the counters (hits, misses, evictions, hit rate) of the representation and plan caches. '''
+
+    global ccu_cache, conversion_plan_cache
+
+    return {'ccu': ccu_cache.get_stats(), 'conversion_plan': conversion_plan_cache.get_stats()}
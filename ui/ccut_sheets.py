@@ -1,13 +1,19 @@
 from argparse import ArgumentParser
+from atomic_file import atomic_open
 from baselutils import column_num2str, fclrprint
-from ccut import ccut, QUDT_PROPERTIES_NAMESPACE, CCUT_NAMESPACE
-from json import dump
-from openpyxl import load_workbook
-from openpyxl.comments import Comment
-from openpyxl.styles import PatternFill
-from os.path import basename
-from pandas import ExcelFile, Series, isnull
+from ccut import ccut, RET_VAL_OK, QUDT_PROPERTIES_NAMESPACE, CCUT_NAMESPACE
+from ccut_cache import LRUCache, PersistentCache, CACHE_MISS, get_ccut_fingerprint, load_ccut_maps
+from ccut_columnar import write_annotation_file, get_annotation_fname, ANNOTATION_FILE_FORMATS
+from ccut_conversion import get_all_ccu_cached, compile_conversion_plan, apply_conversion_plan
+from copy import deepcopy
+from edit_journal import get_file_version, load_journaled_annotation_file
+from hashlib import sha1
+from json import dump, dumps, load
+from os.path import basename, splitext
 from re import search as search_rx
+from threading import Lock, RLock
+from time import perf_counter
+# numpy, openpyxl and pandas are heavy to import, they are imported by the functions using them
 
 IDX_CCUT_DIM = f'{CCUT_NAMESPACE}:hasDimension'
 IDX_CCUT_PRT = f'{CCUT_NAMESPACE}:hasPart'
@@ -17,22 +23,61 @@ IDX_CCUT_EXP = f'{CCUT_NAMESPACE}:exponent'
 IDX_CCUT_MLT = f'{CCUT_NAMESPACE}:multiplier'
 
 MAX_NUM_OF_WORDS_ALLOWED_IN_CELL = 6
+# number of distinct (normalized) cell strings kept in the parse cache
+CELL_CACHE_MAX_SIZE = 65536
+# sheets with less numeric cells than this have no data body, and are fully scanned even in header-only mode
+HEADER_REGION_MIN_NUMERIC_CELLS = 10
+# fill color and comment author of annotated cells (see colorize_spreadsheet)
+ANNOTATED_CELL_COLOR = 'FFFF00'
+ANNOTATION_COMMENT_AUTHOR = 'CCUT'
+# extension of the file recording the annotations last colored into a spreadsheet (kept next to it)
+COLORED_STATE_EXT = '.ccut_colored.json'
+
+# guards the creation (and reset, see init_globals) of the shared CCUT instance, request threads and
+# background jobs may ask for it at the same time
+g_ccut_inst_lock = Lock()
 
 # --- entrypoint --------------------------------------------------------------
 
 def main():
     ap = ArgumentParser(description=f'Process a spreasheet file (xlsx) and generate a dictionary file (json) of cell locations in which units were detected.\n\tUSAGE: python {basename(__file__)} -i INPUT_FILE')
     ap.add_argument('-i', '--input_file', help='input spreasheet file (xlsx).', type=str)
+    ap.add_argument('-c', '--cache_file', help='If specified, keep parse results in a persistent cache file (sqlite) shared across runs.', type=str)
+    ap.add_argument('-s', '--streaming', help='Read the spreadsheet row by row (read-only mode), keeping memory use flat for large files.', action='store_true')
+    ap.add_argument('-r', '--header_only', help='Only look for units in the header rows/columns (text-dominated) of each sheet.', action='store_true')
+    ap.add_argument('-n', '--header_min_numeric_cells', help=f'In header-only mode, fully scan sheets with less numeric cells than this (default: {HEADER_REGION_MIN_NUMERIC_CELLS}).', \
+                    type=int, default=HEADER_REGION_MIN_NUMERIC_CELLS)
+    ap.add_argument('-t', '--stats', help='If specified, dump processing statistics (timings, cell counts) to this file (json).', type=str)
+    ap.add_argument('-u', '--target_units', help='If specified, convert annotated columns to the target unit of their dimension, given in this file (json, i.e. {"L": "km"}).', type=str)
+    ap.add_argument('-o', '--normalized_output', help='output file of the converted columns (xlsx, csv or parquet), used with -u.', type=str)
+    ap.add_argument('-a', '--annotation_file', help='If specified (with -u), convert columns by this annotation file (json, with the edits journaled next to it) instead of processing the spreadsheet.', type=str)
+    ap.add_argument('-f', '--output_format', help='format of the generated dictionary file: json (default), columnar (interned strings and flat records, a fraction of the size), columnar.gz (compressed) or msgpack (binary, needs msgpack).', \
+                    choices=ANNOTATION_FILE_FORMATS, default='json')
+    ap.add_argument('-w', '--warm_start', help='If specified, load CCUT\'s symbol/dimension maps from this snapshot file (json), created on first use.', type=str)
     args = ap.parse_args()
 
     if args.input_file:
-        init_globals()
-        output_fname = '.'.join(args.input_file.split('.')[:-1]) + '.ccut.json'
-        fclrprint(f'Processing file {args.input_file}')
-        dict_out, _ = process_file(args.input_file)
-        with open(output_fname, 'w') as outfile:
-            dump(dict_out, outfile, indent=2)
-        fclrprint(f'Done... generated file {output_fname}', 'g')
+        init_globals(args.cache_file, args.warm_start)
+        if args.annotation_file:
+            dict_out = load_journaled_annotation_file(args.annotation_file)
+        else:
+            output_fname = get_annotation_fname(args.input_file, args.output_format)
+            fclrprint(f'Processing file {args.input_file}')
+            dict_out, _, stats = process_file(args.input_file, streaming=args.streaming, keep_raw_sheets=False, \
+                                              header_only=args.header_only, header_min_numeric_cells=args.header_min_numeric_cells, \
+                                              return_stats=True)
+            write_annotation_file(dict_out, output_fname, args.output_format)
+            if args.stats:
+                with open(args.stats, 'w') as outfile:
+                    dump(stats, outfile, indent=2)
+                fclrprint(f'Dumped processing statistics to file {args.stats}', 'c')
+            fclrprint(f'Done... generated file {output_fname}', 'g')
+        if args.target_units and args.normalized_output:
+            with open(args.target_units, 'r') as read_file:
+                target_units = load(read_file)
+            convert_file_columns(args.input_file, dict_out, target_units, args.normalized_output)
+            fclrprint(f'Done... generated normalized file(s) {args.normalized_output}', 'g')
+        close_persistent_cache()
     else:
         fclrprint(f'An input file was not provided.', 'r')
         exit(1)
@@ -43,35 +88,213 @@ def get_tot_num_of_sheets():
     global g_tot_num_of_sheets
     return g_tot_num_of_sheets
 
-def init_globals():
-    ''' Initializes globals used in file. '''
-
-    global g_ccut_inst, g_tot_num_of_sheets
-    g_ccut_inst = ccut()
+def get_tot_num_of_skipped_cells():
+    ''' Return the total number of cells skipped for being outside a header region (from globals). '''
+
+    global g_tot_num_of_skipped_cells
+    return g_tot_num_of_skipped_cells
+
+def get_parse_stats():
+    ''' Return the counters of CCUT parse calls (calls, failures by exception type, cache hits) (from globals). '''
+
+    global g_parse_stats
+    return deepcopy(g_parse_stats)
+
+def get_cell_cache_stats():
+    ''' Return the hit/miss/eviction counters of the cell parse cache (from globals). '''
+
+    global g_cell_cache
+    return g_cell_cache.get_stats()
+
+def flush_persistent_cache():
+    ''' Commit pending writes of the persistent parse cache (if one was opened in init_globals). '''
+
+    global g_persistent_cache
+    if g_persistent_cache:
+        g_persistent_cache.flush()
+
+def close_persistent_cache():
+    ''' Commit and close the persistent parse cache (if one was opened in init_globals). '''
+
+    global g_persistent_cache
+    if g_persistent_cache:
+        g_persistent_cache.close()
+        g_persistent_cache = None
+
+class SynchronizedCCUT:
+    ''' A CCUT instance whose parse (get_all_ccu) and conversion (convert_ccu2ccu) calls are made one at a time.
+    CCUT's parser keeps its state in the instance, concurrent calls (i.e., of request threads and background jobs)
+    return wrong results or fail. '''
+
+    def __init__(self, ccut_inst):
+        self.ccut_inst = ccut_inst
+        self.lock = RLock()
+
+    def get_all_ccu(self, unit_str):
+        with self.lock:
+            return self.ccut_inst.get_all_ccu(unit_str)
+
+    def convert_ccu2ccu(self, src_ccu, dst_ccu, value):
+        with self.lock:
+            return self.ccut_inst.convert_ccu2ccu(src_ccu, dst_ccu, value)
+
+def get_ccut_instance():
+    ''' Return the CCUT instance shared by all modules (see SynchronizedCCUT), its symbol/dimension maps are loaded
+    on first use (from the snapshot file given to init_globals, if any).
+    Safe to call from several threads: the instance is created once, and its calls are serialized. '''
+
+    global g_ccut_inst, g_maps_snapshot_file
+    ccut_inst = g_ccut_inst
+    if ccut_inst is None:
+        with g_ccut_inst_lock:
+            if g_ccut_inst is None:
+                load_ccut_maps(g_maps_snapshot_file)
+                g_ccut_inst = SynchronizedCCUT(ccut.get_instance())
+            ccut_inst = g_ccut_inst
+    return ccut_inst
+
+def get_extraction_fingerprint(process_file_options=None):
+    ''' Return a fingerprint of the extraction pipeline: the installed CCUT (see get_ccut_fingerprint), the heuristics
+    of this module (its source and thresholds) and the given process_file keyword options.
+    Extraction results are only valid for the fingerprint they were computed with. '''
+
+    hsh = sha1(get_ccut_fingerprint().encode('utf-8'))
+    with open(__file__, 'rb') as read_file:
+        hsh.update(read_file.read())
+    hsh.update(dumps({'max_num_of_words': MAX_NUM_OF_WORDS_ALLOWED_IN_CELL, 'header_min_numeric_cells': HEADER_REGION_MIN_NUMERIC_CELLS, \
+                      'options': process_file_options or dict()}, sort_keys=True).encode('utf-8'))
+    return hsh.hexdigest()
+
+def init_globals(cache_file=None, maps_snapshot_file=None):
+    ''' Initializes globals used in file.
+    If cache_file is given, parse results are also kept in (and read from) a persistent cache file.
+    If maps_snapshot_file is given, CCUT's maps are loaded from (or saved to) this snapshot (see load_ccut_maps). '''
+
+    global g_ccut_inst, g_maps_snapshot_file, g_tot_num_of_sheets, g_tot_num_of_skipped_cells, g_cell_cache, \
+           g_persistent_cache, g_parse_stats
+    with g_ccut_inst_lock:
+        g_ccut_inst = None
+        g_maps_snapshot_file = maps_snapshot_file
     g_tot_num_of_sheets = 0
+    g_tot_num_of_skipped_cells = 0
+    g_parse_stats = {'cache_hits': 0, 'persistent_cache_hits': 0, 'ccut_calls': 0, 'ccut_failures': 0, 'failure_types': dict()}
+    g_cell_cache = LRUCache(CELL_CACHE_MAX_SIZE)
+    g_persistent_cache = None
+    if cache_file:
+        g_persistent_cache = PersistentCache(cache_file, get_ccut_fingerprint())
 
 # --- styling -----------------------------------------------------------------
 
-def colorize_spreadsheet(ant_dict, xls_fname):
-    ''' Colorize the annotated cells in an xlsx file '''
+def get_cell_comments(ant_dict):
+    ''' Return the comment of each annotated cell (its units) in a given dictionary of annotations, as {sheet: {cell: comment}} '''
 
-    # Read excel file
-    workbook = load_workbook(xls_fname)
-
-    # TODO: Reset background color and comments
+    cell_comments = dict()
     for sheet_n,sheet_d in ant_dict.items():
+        sheet_comments = cell_comments[sheet_n] = dict()
         for col_n,col_d in sheet_d.items():
             for row_n,row_d in col_d.items():
-                cell_idx = col_n+str(row_n)
-                workbook[sheet_n][cell_idx].fill = PatternFill(start_color='FFFF00', end_color='FFFF00', fill_type = 'solid')
                 comment = ''
                 for c_unit in row_d:
                     for unit in c_unit['parts']:
                         comment += unit['u'] + '|'
-                workbook[sheet_n][cell_idx].comment = Comment(comment, "CCUT")
+                sheet_comments[col_n+str(row_n)] = comment
+    return cell_comments
+
+def diff_cell_comments(old_cell_comments, new_cell_comments):
+    ''' Return the cells to color ({sheet: {cell: comment}}, new or changed) and the cells to reset ({sheet: [cell]},
+    no longer annotated) to move a spreadsheet from one set of cell comments (see get_cell_comments) to another '''
+
+    to_color = dict()
+    for sheet_n,sheet_comments in new_cell_comments.items():
+        old_sheet_comments = old_cell_comments.get(sheet_n, dict())
+        changed = {cell_idx: comment for cell_idx,comment in sheet_comments.items() if old_sheet_comments.get(cell_idx) != comment}
+        if changed:
+            to_color[sheet_n] = changed
+    to_reset = dict()
+    for sheet_n,old_sheet_comments in old_cell_comments.items():
+        sheet_comments = new_cell_comments.get(sheet_n, dict())
+        stale = [cell_idx for cell_idx in old_sheet_comments if cell_idx not in sheet_comments]
+        if stale:
+            to_reset[sheet_n] = stale
+    return to_color, to_reset
+
+def read_colored_state(xls_fname):
+    ''' Return the cell comments (see get_cell_comments) last colored into an xlsx file, or None if they are
+    unknown (the file was never colored, or it was changed since) '''
+
+    try:
+        with open(xls_fname + COLORED_STATE_EXT, 'r') as read_file:
+            colored_state = load(read_file)
+    except (OSError, ValueError):
+        return None
+    if colored_state.get('version') != get_file_version(xls_fname):
+        return None
+    return colored_state['cells']
+
+def write_colored_state(xls_fname, cell_comments):
+    ''' Record the cell comments colored into an xlsx file (along with the version of the file) '''
+
+    with atomic_open(xls_fname + COLORED_STATE_EXT) as outfile:
+        dump({'version': get_file_version(xls_fname), 'cells': cell_comments}, outfile)
+
+def write_colored_overlay(cell_comments, overlay_fname):
+    ''' Write the annotated cells (colored, holding their units) to an xlsx file of their own '''
+
+    from openpyxl import Workbook
+    from openpyxl.styles import PatternFill
+
+    workbook = Workbook()
+    workbook.remove(workbook.active)
+    fill = PatternFill(start_color=ANNOTATED_CELL_COLOR, end_color=ANNOTATED_CELL_COLOR, fill_type='solid')
+    for sheet_n,sheet_comments in cell_comments.items():
+        worksheet = workbook.create_sheet(sheet_n)
+        for cell_idx,comment in sheet_comments.items():
+            worksheet[cell_idx].value = comment
+            worksheet[cell_idx].fill = fill
+    workbook.save(overlay_fname)
+    workbook.close()
+
+def colorize_spreadsheet(ant_dict, xls_fname, overlay_fname=None):
+    ''' Colorize the annotated cells in an xlsx file (a fill and a comment listing their units).
+    Only cells changed since the last call are updated (cells no longer annotated are reset), using the colored
+    state recorded next to the file (fname.ccut_colored.json); the file is not rewritten if nothing changed.
+    If overlay_fname is given, the xlsx file is left as is and the annotated cells are written (colored, holding
+    their units) to this (lightweight) xlsx file instead. '''
+
+    from openpyxl import load_workbook
+    from openpyxl.comments import Comment
+    from openpyxl.styles import PatternFill
+
+    cell_comments = get_cell_comments(ant_dict)
+    if overlay_fname:
+        write_colored_overlay(cell_comments, overlay_fname)
+        return
+
+    colored_cell_comments = read_colored_state(xls_fname)
+    to_color, to_reset = diff_cell_comments(colored_cell_comments or dict(), cell_comments)
+    if colored_cell_comments is not None and not to_color and not to_reset:
+        return
+
+    # Read excel file
+    workbook = load_workbook(xls_fname)
+
+    # style objects are shared by all cells (comments are bound to a single cell, one is made per cell)
+    fill = PatternFill(start_color=ANNOTATED_CELL_COLOR, end_color=ANNOTATED_CELL_COLOR, fill_type='solid')
+    no_fill = PatternFill(fill_type=None)
+    for sheet_n,stale in to_reset.items():
+        if sheet_n in workbook.sheetnames:
+            for cell_idx in stale:
+                workbook[sheet_n][cell_idx].fill = no_fill
+                workbook[sheet_n][cell_idx].comment = None
+    for sheet_n,changed in to_color.items():
+        if sheet_n in workbook.sheetnames:
+            for cell_idx,comment in changed.items():
+                workbook[sheet_n][cell_idx].fill = fill
+                workbook[sheet_n][cell_idx].comment = Comment(comment, ANNOTATION_COMMENT_AUTHOR)
 
     workbook.save(xls_fname)
     workbook.close()
+    write_colored_state(xls_fname, cell_comments)
 
 # --- processing --------------------------------------------------------------
 
@@ -120,11 +343,9 @@ def process_ccu_repr_output(ccut_repr):
     else:
         return None
 
-def process_cell(cell_content):
-    ''' Processes a cell content looking for units, returns a structured output (dict) of the cell.
-    See process_ccu_repr_output documentation for more info. '''
-
-    global g_ccut_inst
+def normalize_cell_content(cell_content):
+    ''' Applies the cell heuristics to a cell content, returns the string to be parsed by CCUT
+    or None if the cell should be skipped. '''
 
     input_str = str(cell_content)
 
@@ -145,12 +366,51 @@ def process_cell(cell_content):
         return None
     ###########################################################################
 
+    return input_str
+
+def parse_normalized_string(input_str):
+    ''' Parses a normalized cell string with CCUT, returns a structured output (dict) or None.
+    Results are memoized in the cell cache (and the persistent cache, if enabled),
+    the returned dict is always a private copy. '''
+
+    global g_cell_cache, g_persistent_cache, g_parse_stats
+
+    cached = g_cell_cache.get(input_str, CACHE_MISS)
+    if cached is not CACHE_MISS:
+        g_parse_stats['cache_hits'] += 1
+        return deepcopy(cached)
+    if g_persistent_cache:
+        cached = g_persistent_cache.get(input_str, CACHE_MISS)
+        if cached is not CACHE_MISS:
+            g_parse_stats['persistent_cache_hits'] += 1
+            g_cell_cache.put(input_str, cached)
+            return deepcopy(cached)
+
+    g_parse_stats['ccut_calls'] += 1
     try:
-        urepr = g_ccut_inst.get_all_ccu(input_str)[0] # we check only the top result (TODO: fix)
-        return process_ccu_repr_output(urepr)
-    except:
+        urepr = get_ccut_instance().get_all_ccu(input_str)[0] # we check only the top result (TODO: fix)
+        cell_dict = process_ccu_repr_output(urepr)
+    except Exception as e:
+        # unparsable strings are not units, but keep count of them (by exception type)
+        g_parse_stats['ccut_failures'] += 1
+        err_type = type(e).__name__
+        g_parse_stats['failure_types'][err_type] = g_parse_stats['failure_types'].get(err_type, 0) + 1
+        cell_dict = None
+    g_cell_cache.put(input_str, deepcopy(cell_dict))
+    if g_persistent_cache:
+        g_persistent_cache.put(input_str, cell_dict)
+    return cell_dict
+
+def process_cell(cell_content):
+    ''' Processes a cell content looking for units, returns a structured output (dict) of the cell.
+    See process_ccu_repr_output documentation for more info. '''
+
+    input_str = normalize_cell_content(cell_content)
+    if input_str is None:
         return None
 
+    return parse_normalized_string(input_str)
+
 def insert_instance_to_sheet_dict(column_idx, row_idx, sheet_dict, unit_inst_dict):
     ''' Insert a compound unit instance to a dictionary holding the sheet units info. '''
     
@@ -160,55 +420,410 @@ def insert_instance_to_sheet_dict(column_idx, row_idx, sheet_dict, unit_inst_dic
         sheet_dict[column_idx][row_idx] = list()
     sheet_dict[column_idx][row_idx].append(unit_inst_dict)
 
-def process_sheet(dataframe):
-    ''' Processes a sheet looking for units, returns a structured output (dict) of the sheet. '''
+def filter_cell_contents(values):
+    ''' Vectorized version of normalize_cell_content over an array of (non-null) cell values.
+    Returns a boolean array of the values that pass the heuristics and an array of their normalized strings. '''
+
+    from pandas import Series
+
+    input_strs = Series(values, dtype=object).astype(str)
+
+    ########################## NAIVE HEURISTICS ###############################
+    # replace paranthesis with spaces
+    input_strs = input_strs.str.replace(r'[()\[\]]', ' ', regex=True)
+    # skip cells that don't have any text element (this also skips empty cells)
+    has_text = input_strs.str.contains('[a-zA-Z]', regex=True)
+    # skip cells with too many words in dict (post-observation of a dev-set)
+    has_few_words = (input_strs.str.count(' ') + 1) <= MAX_NUM_OF_WORDS_ALLOWED_IN_CELL
+    ###########################################################################
+
+    return (has_text & has_few_words).to_numpy(dtype=bool), input_strs.to_numpy(dtype=object)
+
+def get_header_region(row_text_counts, row_num_counts, col_text_counts, col_num_counts, min_numeric_cells):
+    ''' Detects the header bands of a table: rows/columns where text cells are at least as many as numeric cells.
+    Returns a (rows mask, columns mask) pair of numpy arrays, or None if the sheet has no numeric body
+    (less than min_numeric_cells numeric cells), in which case the whole sheet should be scanned. '''
+
+    if row_num_counts.sum() < min_numeric_cells:
+        return None
+    header_rows = (row_text_counts > 0) & (row_text_counts >= row_num_counts)
+    header_cols = (col_text_counts > 0) & (col_text_counts >= col_num_counts)
+    return header_rows, header_cols
+
+def get_candidate_cells(dataframe, header_only=False, header_min_numeric_cells=HEADER_REGION_MIN_NUMERIC_CELLS):
+    ''' Applies the cell heuristics to a whole sheet at once (column by column).
+    Returns a list of (row string, column string, normalized cell string) for the cells to be parsed, ordered by row,
+    the number of cells skipped for being outside the header region (only if header_only, see get_header_region)
+    and the number of cells in the sheet. '''
+
+    from numpy import empty, isinf, zeros
+    from pandas import notna
+
+    num_rows, num_cols = dataframe.shape
+    is_candidate = zeros((num_rows, num_cols), dtype=bool)
+    cell_strs = empty((num_rows, num_cols), dtype=object)
+    is_text = zeros((num_rows, num_cols), dtype=bool)
+    is_numeric = zeros((num_rows, num_cols), dtype=bool)
+    for c_idx in range(num_cols):
+        column = dataframe.iloc[:, c_idx]
+        if column.dtype.kind in 'iu':
+            # integer columns never hold text
+            is_numeric[:, c_idx] = True
+            continue
+        elif column.dtype.kind == 'f':
+            # float columns only hold text as 'inf'/'-inf' (NaN is an empty cell)
+            is_numeric[:, c_idx] = notna(column.to_numpy())
+            r_idxs = isinf(column.to_numpy()).nonzero()[0]
+        else:
+            col_notna = notna(column.to_numpy())
+            if header_only:
+                col_is_str = (column.map(type) == str).to_numpy(dtype=bool)
+                is_text[:, c_idx] = col_notna & col_is_str
+                is_numeric[:, c_idx] = col_notna & ~col_is_str
+            r_idxs = col_notna.nonzero()[0]
+        if len(r_idxs) == 0:
+            continue
+        col_mask, col_strs = filter_cell_contents(column.to_numpy()[r_idxs])
+        is_candidate[r_idxs, c_idx] = col_mask
+        cell_strs[r_idxs, c_idx] = col_strs
+
+    num_skipped = 0
+    if header_only:
+        header_region = get_header_region(is_text.sum(axis=1), is_numeric.sum(axis=1), \
+                                          is_text.sum(axis=0), is_numeric.sum(axis=0), header_min_numeric_cells)
+        if header_region:
+            header_rows, header_cols = header_region
+            num_candidates = is_candidate.sum()
+            is_candidate &= header_rows[:, None] | header_cols[None, :]
+            num_skipped = int(num_candidates - is_candidate.sum())
+
+    candidates = list()
+    col_names = dict()
+    for r_idx, c_idx in zip(*is_candidate.nonzero()):
+        if c_idx not in col_names:
+            col_names[c_idx] = column_num2str(c_idx+1)
+        candidates.append((str(r_idx+1), col_names[c_idx], cell_strs[r_idx, c_idx]))
+    return candidates, num_skipped, num_rows * num_cols
+
+def get_candidate_cells_from_worksheet(worksheet, raw_rows=None, header_only=False, \
+                                       header_min_numeric_cells=HEADER_REGION_MIN_NUMERIC_CELLS):
+    ''' Streaming version of get_candidate_cells over a (read-only) openpyxl worksheet.
+    Only string cells are considered, numeric/date/boolean/error cells are skipped without conversion.
+    If raw_rows is a list, the values of each row are appended to it. '''
+
+    cells = list()
+    num_seen = 0
+    row_text_counts, row_num_counts = list(), list()
+    col_text_counts, col_num_counts = dict(), dict()
+    for r_idx, row in enumerate(worksheet.iter_rows()):
+        if raw_rows is not None:
+            raw_rows.append([cell.value for cell in row])
+        num_seen += len(row)
+        row_text, row_num = 0, 0
+        for c_idx, cell in enumerate(row):
+            if cell.data_type != 's':
+                if header_only and cell.value is not None and cell.data_type != 'e':
+                    row_num += 1
+                    col_num_counts[c_idx] = col_num_counts.get(c_idx, 0) + 1
+                continue
+            if header_only:
+                row_text += 1
+                col_text_counts[c_idx] = col_text_counts.get(c_idx, 0) + 1
+            input_str = normalize_cell_content(cell.value)
+            if input_str is None:
+                continue
+            cells.append((r_idx, c_idx, input_str))
+        row_text_counts.append(row_text)
+        row_num_counts.append(row_num)
+
+    num_skipped = 0
+    if header_only:
+        from numpy import array
+        num_cols = max(list(col_text_counts) + list(col_num_counts), default=-1) + 1
+        header_region = get_header_region(array(row_text_counts), array(row_num_counts), \
+                                          array([col_text_counts.get(c_idx, 0) for c_idx in range(num_cols)]), \
+                                          array([col_num_counts.get(c_idx, 0) for c_idx in range(num_cols)]), \
+                                          header_min_numeric_cells)
+        if header_region:
+            header_rows, header_cols = header_region
+            num_candidates = len(cells)
+            cells = [cell for cell in cells if header_rows[cell[0]] or header_cols[cell[1]]]
+            num_skipped = num_candidates - len(cells)
+
+    candidates = list()
+    col_names = dict()
+    for r_idx, c_idx, input_str in cells:
+        if c_idx not in col_names:
+            col_names[c_idx] = column_num2str(c_idx+1)
+        candidates.append((str(r_idx+1), col_names[c_idx], input_str))
+    return candidates, num_skipped, num_seen
+
+def parse_candidate_strings(input_strs):
+    ''' Parses each distinct normalized string once.
+    Returns a dictionary mapping each string to its structured output (dict) or None. '''
+
+    return {input_str: parse_normalized_string(input_str) for input_str in dict.fromkeys(input_strs)}
+
+def build_sheet_dict(candidates, parsed_strs):
+    ''' Scatters the parsed strings back to their (row, column) locations in a sheet.
+    Returns a structured output (dict) of the sheet or None. '''
 
     # init sheet dict
     sh_dict = dict()
-    # Fill merged rows with row value
-    dataframe.index = Series(dataframe.index)
-    # iterate over all columns in a given sheet
-    for r_idx, row in dataframe.loc[:].iterrows():
-        r_idx_str = str(r_idx+1)
-        # iterate over row cells (Each column)
-        for c_idx, cell in enumerate(row):
-            c_idx_str = column_num2str(c_idx+1)
-            # if not NaN
-            if not isnull(cell):
-                #fclrprint(f'analyzing [{c_idx_str}][{r_idx_str}] {cell}', 'c')
-                cell_dict = process_cell(cell)
-                # TODO: case where there are multiple compound units in cell...
-                if cell_dict:
-                    insert_instance_to_sheet_dict(c_idx_str, r_idx_str, sh_dict, cell_dict)
-                    #totstr = ', '.join(u['u'] for u in cell_dict['parts'])
-                    #fclrprint(f'[{c_idx_str}][{r_idx_str}] {totstr}', 'g')
+    # iterate over the cells that pass the heuristics (by row, then column)
+    for r_idx_str, c_idx_str, input_str in candidates:
+        #fclrprint(f'analyzing [{c_idx_str}][{r_idx_str}] {input_str}', 'c')
+        cell_dict = parsed_strs[input_str]
+        # TODO: case where there are multiple compound units in cell...
+        if cell_dict:
+            # each location gets its own copy (annotations are edited per cell)
+            insert_instance_to_sheet_dict(c_idx_str, r_idx_str, sh_dict, deepcopy(cell_dict))
+            #totstr = ', '.join(u['u'] for u in cell_dict['parts'])
+            #fclrprint(f'[{c_idx_str}][{r_idx_str}] {totstr}', 'g')
     if sh_dict:
         return sh_dict
     return None
 
-def process_file(fname):
-    ''' Processes a file looking for units, returns a structured output (dict) of the file. '''
-
-    global g_tot_num_of_sheets
+def process_sheet(dataframe):
+    ''' Processes a sheet looking for units, returns a structured output (dict) of the sheet. '''
 
+    candidates, _, _ = get_candidate_cells(dataframe)
+    parsed_strs = parse_candidate_strings(input_str for _, _, input_str in candidates)
+    return build_sheet_dict(candidates, parsed_strs)
+
+def iter_sheet_candidates(fname, streaming=False, raw_f_dict=None, header_only=False, \
+                          header_min_numeric_cells=HEADER_REGION_MIN_NUMERIC_CELLS):
+    ''' Yields (sheet name, candidate cells, sheet statistics) for each sheet in a file (see get_candidate_cells).
+    Sheet statistics hold the load/filter timings, the number of cells seen/skipped/kept as candidates
+    and the (1-based) position of the sheet in the file along with the number of sheets.
+    If streaming, the file (xlsx) is read row by row in openpyxl's read-only mode instead of loading
+    each sheet into a DataFrame (reading and filtering are then timed together, as 'load').
+    If raw_f_dict is a dict, the raw sheets (DataFrames) are stored in it. '''
+
+    if streaming:
+        from openpyxl import load_workbook
+        workbook = load_workbook(fname, read_only=True, data_only=True)
+        try:
+            for sheet_idx, worksheet in enumerate(workbook.worksheets):
+                start = perf_counter()
+                # do not trust the stored dimensions, read all rows and columns
+                worksheet.reset_dimensions()
+                raw_rows = list() if raw_f_dict is not None else None
+                candidates, num_skipped, num_seen = get_candidate_cells_from_worksheet(worksheet, raw_rows, header_only, \
+                                                                                       header_min_numeric_cells)
+                if raw_f_dict is not None:
+                    from pandas import DataFrame
+                    raw_f_dict[worksheet.title] = DataFrame(raw_rows)
+                sheet_stats = {'seconds': {'load': perf_counter() - start, 'filter': 0.0},
+                               'cells': {'seen': num_seen, 'skipped_header': num_skipped, 'candidates': len(candidates)},
+                               'position': [sheet_idx+1, len(workbook.worksheets)]}
+                yield worksheet.title, candidates, sheet_stats
+        finally:
+            workbook.close()
+    else:
+        from pandas import ExcelFile
+        # Load spreadsheets
+        xl = ExcelFile(fname)
+        # iterate over sheets
+        for sheet_idx, sheet_name in enumerate(xl.sheet_names):
+            start = perf_counter()
+            # Load a sheet into a DataFrame by name
+            df = xl.parse(sheet_name, header=None, skip_blank_lines=False)
+            if raw_f_dict is not None:
+                raw_f_dict[sheet_name] = df
+            load_seconds = perf_counter() - start
+            start = perf_counter()
+            candidates, num_skipped, num_seen = get_candidate_cells(df, header_only, header_min_numeric_cells)
+            sheet_stats = {'seconds': {'load': load_seconds, 'filter': perf_counter() - start},
+                           'cells': {'seen': num_seen, 'skipped_header': num_skipped, 'candidates': len(candidates)},
+                           'position': [sheet_idx+1, len(xl.sheet_names)]}
+            yield sheet_name, candidates, sheet_stats
+
+def process_file(fname, streaming=False, keep_raw_sheets=True, header_only=False, \
+                 header_min_numeric_cells=HEADER_REGION_MIN_NUMERIC_CELLS, return_stats=False, progress_callback=None):
+    ''' Processes a file looking for units, returns a structured output (dict) of the file
+    and a dict of the raw sheets (DataFrames, empty unless keep_raw_sheets).
+    Candidate cells of all sheets are collected first, so each distinct string in the file is parsed once.
+    If streaming, the file (xlsx) is read lazily (see iter_sheet_candidates) keeping memory use flat.
+    If header_only, only cells in the header rows/columns of each sheet are parsed (see get_header_region).
+    If return_stats, a third item is returned: a dictionary of per-file and per-sheet timings and cell counts,
+    along with the CCUT parse counters (calls, failures, cache hits) for this file.
+    If progress_callback is given, it is called as progress_callback(num_of_steps_done, num_of_steps, message)
+    after each sheet is read and once all strings are parsed (one step per sheet, plus one for parsing). '''
+
+    global g_tot_num_of_sheets, g_tot_num_of_skipped_cells
+
+    file_start = perf_counter()
+    parse_stats_before = get_parse_stats()
     # init file dictionaries
     f_dict = dict()
     raw_f_dict = dict()
-    # Load spreadsheets
-    xl = ExcelFile(fname)
-    # iterate over sheets
-    for sheet_name in xl.sheet_names:
+    sheets_candidates = dict()
+    sheets_stats = dict()
+    for sheet_name, candidates, sheet_stats in iter_sheet_candidates(fname, streaming, raw_f_dict if keep_raw_sheets else None, \
+                                                                     header_only, header_min_numeric_cells):
         g_tot_num_of_sheets += 1
-        # Load a sheet into a DataFrame by name
-        df = xl.parse(sheet_name, header=None, skip_blank_lines=False)
-        raw_f_dict[sheet_name] = df
+        num_skipped = sheet_stats['cells']['skipped_header']
+        g_tot_num_of_skipped_cells += num_skipped
         fclrprint(f'Processing Sheet {sheet_name}...')
-        sht_dict = process_sheet(df)
+        if num_skipped:
+            fclrprint(f'Skipped {num_skipped} cells outside the header region of sheet {sheet_name}', 'c')
+        sheets_candidates[sheet_name] = candidates
+        sheets_stats[sheet_name] = sheet_stats
+        if progress_callback:
+            sheet_pos, num_of_sheets = sheet_stats['position']
+            progress_callback(sheet_pos, num_of_sheets+1, f'Read sheet {sheet_name} ({sheet_pos}/{num_of_sheets})')
+    # parse distinct strings (of all sheets) once
+    start = perf_counter()
+    parsed_strs = parse_candidate_strings(input_str for candidates in sheets_candidates.values() \
+                                                    for _, _, input_str in candidates)
+    parse_seconds = perf_counter() - start
+    start = perf_counter()
+    for sheet_name, candidates in sheets_candidates.items():
+        sht_dict = build_sheet_dict(candidates, parsed_strs)
+        sheets_stats[sheet_name]['cells']['recognized'] = 0
         if sht_dict:
             f_dict[sheet_name] = sht_dict
-    if f_dict:
+            sheets_stats[sheet_name]['cells']['recognized'] = sum(len(col_d) for col_d in sht_dict.values())
+    post_process_seconds = perf_counter() - start
+    if progress_callback:
+        num_of_steps = len(sheets_candidates) + 1
+        progress_callback(num_of_steps, num_of_steps, f'Parsed {len(parsed_strs)} distinct strings')
+    if not f_dict:
+        f_dict = None
+
+    if not return_stats:
         return f_dict, raw_f_dict
-    return None, raw_f_dict
+
+    parse_stats = get_parse_stats()
+    for key in ['cache_hits', 'persistent_cache_hits', 'ccut_calls', 'ccut_failures']:
+        parse_stats[key] -= parse_stats_before[key]
+    for err_type, count in parse_stats_before['failure_types'].items():
+        parse_stats['failure_types'][err_type] -= count
+        if parse_stats['failure_types'][err_type] == 0:
+            del parse_stats['failure_types'][err_type]
+    stats = {'file': fname,
+             'seconds': {'load': sum(sh_s['seconds']['load'] for sh_s in sheets_stats.values()),
+                         'filter': sum(sh_s['seconds']['filter'] for sh_s in sheets_stats.values()),
+                         'parse': parse_seconds, 'post_process': post_process_seconds,
+                         'total': perf_counter() - file_start},
+             'cells': {key: sum(sh_s['cells'][key] for sh_s in sheets_stats.values()) \
+                       for key in ['seen', 'skipped_header', 'candidates', 'recognized']},
+             'parse': parse_stats,
+             'sheets': sheets_stats}
+    stats['cells']['distinct_strings'] = len(parsed_strs)
+    return f_dict, raw_f_dict, stats
+
+# --- normalization -----------------------------------------------------------
+
+def get_column_conversions(ant_dict_sheet, dataframe, target_units):
+    ''' Find the annotated (header) cells of a sheet whose dimension has a target unit.
+    Returns a list of (column index, first row index, last row index (exclusive), header string, target unit string)
+    where rows are 0-based positions of the values below the header, up to the next annotated cell in the column. '''
+
+    from openpyxl.utils import column_index_from_string
+
+    conversions = list()
+    for col_n, col_d in ant_dict_sheet.items():
+        c_idx = column_index_from_string(col_n) - 1
+        if c_idx >= dataframe.shape[1]:
+            continue
+        header_rows = sorted(int(row_n) for row_n in col_d)
+        for h_idx, header_row in enumerate(header_rows):
+            cell_list = col_d[str(header_row)]
+            # assuming a single compound unit in cell
+            if not cell_list or cell_list[0].get('dimension') not in target_units:
+                continue
+            end_row = header_rows[h_idx+1] - 1 if h_idx+1 < len(header_rows) else dataframe.shape[0]
+            input_str = normalize_cell_content(dataframe.iat[header_row-1, c_idx])
+            if input_str is None:
+                fclrprint(f'Cell {col_n}{header_row} does not hold a unit string, skipping its column...', 'r')
+                continue
+            conversions.append((c_idx, header_row, end_row, input_str, target_units[cell_list[0]['dimension']]))
+    return conversions
+
+def get_column_conversion_plan(input_str, target_str, plans):
+    ''' Return the conversion plan (see ccut_conversion) from a header string to a target unit string, memoized in plans.
+    As in process_ccu_repr_output, unrecognized parts of the header (i.e., 'Distance' in 'Distance mi') are ignored. '''
+
+    if (input_str, target_str) not in plans:
+        ccut_inst = get_ccut_instance()
+        src_ccu = deepcopy(get_all_ccu_cached(ccut_inst, input_str)[0]) # we check only the top result (TODO: fix)
+        if IDX_CCUT_PRT in src_ccu:
+            src_ccu[IDX_CCUT_PRT] = [prt for prt in src_ccu[IDX_CCUT_PRT] if "UNKNOWN TYPE" != prt[IDX_QDTP_QTK]]
+        dst_ccu = get_all_ccu_cached(ccut_inst, target_str)[0]
+        plans[(input_str, target_str)] = compile_conversion_plan(ccut_inst, src_ccu, dst_ccu)
+    return plans[(input_str, target_str)]
+
+def convert_dataframe_columns(dataframe, conversions, plans):
+    ''' Convert the numeric values of the given column ranges (see get_column_conversions) in place,
+    a whole column range at a time (one factor/offset per column). Returns a list of conversion summaries (dict). '''
+
+    from numpy import isnan, where
+    from pandas import to_numeric
+
+    summaries = list()
+    for c_idx, first_row, end_row, input_str, target_str in conversions:
+        plan = get_column_conversion_plan(input_str, target_str, plans)
+        summary = {'column': column_num2str(c_idx+1), 'row': str(first_row), 'unit': input_str, 'target': target_str, \
+                   'status': plan['status'], 'status_msg': plan['status_msg'], 'num_of_values': 0}
+        summaries.append(summary)
+        if plan['status'] != RET_VAL_OK:
+            continue
+        col_values = dataframe.iloc[first_row:end_row, c_idx]
+        num_values = to_numeric(col_values, errors='coerce').to_numpy(dtype=float)
+        is_num = ~isnan(num_values)
+        conv_values, _, _ = apply_conversion_plan(plan, num_values)
+        dataframe.iloc[first_row:end_row, c_idx] = where(is_num, conv_values, col_values.to_numpy(dtype=object))
+        dataframe.iat[first_row-1, c_idx] = target_str
+        summary['num_of_values'] = int(is_num.sum())
+    return summaries
+
+def write_normalized_sheets(dataframes, output_fname):
+    ''' Write the (normalized) sheets by the output file extension: a single xlsx workbook,
+    or one csv/parquet file per sheet (named OUTPUT.SHEET.csv / OUTPUT.SHEET.parquet). '''
+
+    base_fname, ext = splitext(output_fname)
+    if ext == '.xlsx':
+        from pandas import ExcelWriter
+        with ExcelWriter(output_fname) as writer:
+            for sheet_name, df in dataframes.items():
+                df.to_excel(writer, sheet_name=sheet_name, header=False, index=False)
+        return
+    for sheet_name, df in dataframes.items():
+        sheet_fname = f'{base_fname}.{sheet_name}{ext}'
+        if ext == '.csv':
+            df.to_csv(sheet_fname, header=False, index=False)
+        elif ext == '.parquet':
+            # parquet requires string column names (and pyarrow or fastparquet)
+            df = df.set_axis([column_num2str(c_idx+1) for c_idx in range(df.shape[1])], axis=1)
+            df.to_parquet(sheet_fname, index=False)
+        else:
+            raise ValueError(f'Unsupported output format {ext} (expected .xlsx, .csv or .parquet)')
+
+def convert_file_columns(fname, ant_dict, target_units, output_fname):
+    ''' Convert the numeric columns under annotated header cells to the target unit of their dimension
+    (target_units maps a dimension string, i.e. "M L-3", to a unit string, i.e. "g/L") and write the
+    normalized sheets to output_fname (see write_normalized_sheets). Returns a list of conversion summaries (dict). '''
+
+    from pandas import ExcelFile
+
+    summaries = list()
+    dataframes = dict()
+    plans = dict()
+    xl = ExcelFile(fname)
+    for sheet_name in xl.sheet_names:
+        df = xl.parse(sheet_name, header=None, skip_blank_lines=False)
+        if ant_dict and sheet_name in ant_dict:
+            fclrprint(f'Converting Sheet {sheet_name}...')
+            for summary in convert_dataframe_columns(df, get_column_conversions(ant_dict[sheet_name], df, target_units), plans):
+                summary['sheet'] = sheet_name
+                summaries.append(summary)
+                if summary['status'] != RET_VAL_OK:
+                    fclrprint(f'Could not convert {sheet_name}!{summary["column"]}{summary["row"]} from {summary["unit"]} to {summary["target"]} ({summary["status_msg"]})', 'r')
+        dataframes[sheet_name] = df
+    write_normalized_sheets(dataframes, output_fname)
+    return summaries
 
 if __name__ == '__main__':
     main()
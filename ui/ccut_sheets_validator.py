@@ -1,12 +1,25 @@
 from argparse import ArgumentParser
+from atomic_file import atomic_open
 from baselutils import fclrprint, get_num_of_files_in_dir
-from ccut_sheets import init_globals, process_file, get_tot_num_of_sheets
+from ccut_sheets import init_globals, process_file, get_tot_num_of_sheets, get_tot_num_of_skipped_cells, \
+                        get_cell_cache_stats, get_ccut_instance, flush_persistent_cache, close_persistent_cache, \
+                        get_extraction_fingerprint, HEADER_REGION_MIN_NUMERIC_CELLS
+from collections import Counter
+from ccut_columnar import ColumnarAnnotations
+from concurrent.futures import ProcessPoolExecutor
 from datetime import timedelta
-from json import load
+from edit_journal import load_journaled_annotation_file
+from hashlib import sha1
+from json import dump, load
 from os import listdir
 from os.path import basename, exists, join
 from time import time
 
+# attributes of an atomic unit compared when matching actual and expected units (u: unit, p: prefix, e: exponent, m: multiplier)
+PART_MATCH_ATTRS = ('u',)
+# extension of the extraction results cached next to each xlsx file (see ccut_test_xlsx_file)
+EXTRACTION_CACHE_EXT = '.ccutext.json'
+
 # --- entrypoint --------------------------------------------------------------
 
 def main():
@@ -18,6 +31,15 @@ def main():
     ap.add_argument('-d', '--dir_name', help='directory path.', type=str)
     ap.add_argument('-o', '--output_debug_file', help='If specified, print debug summary to output file (csv).', type=str)
     ap.add_argument('-g', '--ignore_files_list', help='If specified, ignore the list of file titles in given file (json).', type=str)
+    ap.add_argument('-c', '--cache_file', help='If specified, keep parse results in a persistent cache file (sqlite) shared across runs.', type=str)
+    ap.add_argument('-s', '--streaming', help='Read the spreadsheets row by row (read-only mode), keeping memory use flat for large files.', action='store_true')
+    ap.add_argument('-r', '--header_only', help='Only look for units in the header rows/columns (text-dominated) of each sheet.', action='store_true')
+    ap.add_argument('-n', '--header_min_numeric_cells', help=f'In header-only mode, fully scan sheets with less numeric cells than this (default: {HEADER_REGION_MIN_NUMERIC_CELLS}).', \
+                    type=int, default=HEADER_REGION_MIN_NUMERIC_CELLS)
+    ap.add_argument('-j', '--jobs', help='number of worker processes to run files on (default: 1).', type=int, default=1)
+    ap.add_argument('-w', '--warm_start', help='If specified, load CCUT\'s symbol/dimension maps from this snapshot file (json), created on first use.', type=str)
+    ap.add_argument('-x', '--extraction_cache', help=f'Keep the extraction results of each xlsx file next to it ({EXTRACTION_CACHE_EXT}), and reuse them while the file and the pipeline are unchanged.', \
+                    action='store_true')
     args = ap.parse_args()
 
     if args.dir_name:
@@ -28,7 +50,10 @@ def main():
             with open(args.ignore_files_list, 'r') as infile:
                 g_list_of_ignored_articles = load(infile)
         # test each .xlsx and .ccutvld.json
-        ccut_test_xlsx_files_in_dir(args.dir_name, args.output_debug_file)
+        process_file_options = {'streaming': args.streaming, 'header_only': args.header_only, \
+                                'header_min_numeric_cells': args.header_min_numeric_cells}
+        ccut_test_xlsx_files_in_dir(args.dir_name, args.output_debug_file, args.cache_file, args.jobs, process_file_options, \
+                                    args.warm_start, args.extraction_cache)
     else:
         fclrprint(f'Directory path was not provided.', 'r')
         exit(1)
@@ -58,147 +83,112 @@ def append_to_debug_dict(atomic_unit, debug_class=None):
             g_err_dct_p_unit[atomic_unit['u']]['fn'] = 0
         g_err_dct_p_unit[atomic_unit['u']][debug_class] += 1
 
-def count_number_of_unit_instances_in_cell(cell, debug_class=None):
-    ''' Return number of unit instances in a cell. '''
-
-    global g_err_dbg
-
-    # cell is a list of compound units (each item in list has a unit)
-    total_u = 0
-    for compound_unit in cell:
-        total_u += len(compound_unit['parts'])
-        # --- debug prints for errors dict ----------
-        if g_err_dbg and debug_class:
-            for atmu in compound_unit['parts']:
-                append_to_debug_dict(atmu, debug_class)
-        # -------------------------------------------
-    return total_u
-
-def count_number_of_unit_instances_in_column(column, debug_class=None):
-    ''' Return number of unit instances in a column (all rows). '''
-
-    total_u = 0
-    for _, cell in column.items():
-        total_u += count_number_of_unit_instances_in_cell(cell, debug_class)
-    return total_u
-
-def count_number_of_unit_instances_in_sheet(sheet, debug_class=None):
-    ''' Return number of unit instances in a sheet. '''
-
-    total_u = 0
-    for _, column in sheet.items():
-        total_u += count_number_of_unit_instances_in_column(column, debug_class)
-    return total_u
-
-def check_if_lists_contain_match_and_delete(cell_list_1, cell_list_2):
-    ''' Check if lists contain any matches.
-    Return a boolean indicator and indexes of the found units in each list if match found. '''
+def get_part_match_key(atomic_unit, match_attrs=PART_MATCH_ATTRS):
+    ''' Return the key by which an atomic unit (part) is matched: the values of its match_attrs (None if missing). '''
 
-    global g_err_dbg
+    return tuple(atomic_unit.get(attr) for attr in match_attrs)
 
-    # iterate over items in actual list (compound units)
-    for idx_cl1, cl1 in enumerate(cell_list_1):
-        # iterate over each atomic unit in a compound unit (actual)
-        for idx_al1, al1 in enumerate(cl1['parts']):
-            # iterate over items in expected list (compound units)
-            for idx_cl2, cl2 in enumerate(cell_list_2):
-                # iterate over each atomic unit in a compound unit (expected)
-                for idx_al2, al2 in enumerate(cl2['parts']):
-                    # compare unit URIs
-                    if al1['u'] == al2['u']:
-                        # --- debug prints for errors dict ----------
-                        if g_err_dbg:
-                            append_to_debug_dict(al1, 'tp')
-                        # -------------------------------------------
-                        # TODO: compare other attributes
-                        return True, idx_cl1, idx_al1, idx_cl2, idx_al2
-
-    return False, None, None, None, None
-
-def compare_cell_lists(actual_cell_lst, expected_cell_lst):
+def diff_cell_lists(actual_cell_lst, expected_cell_lst, match_attrs=PART_MATCH_ATTRS):
     ''' Compare two given lists (lists of dictionaries representing each cell's units content in the spreadsheet).
-    Return the number of True-Positives and update (delete elements from) the lists. '''
-
-    tp = 0
-    while True:
-        res, c_a_idx, a_a_idx, c_e_idx, a_e_idx = check_if_lists_contain_match_and_delete(actual_cell_lst, expected_cell_lst)
-        if res:
-            actual_cell_lst[c_a_idx]['parts'].pop(a_a_idx)
-            expected_cell_lst[c_e_idx]['parts'].pop(a_e_idx)
-            tp += 1
-        else:
-            break
-    
-    return tp
-
-def compare_actual_with_expected_columns(actual_col, expected_col):
-    ''' Compare two given dictionaries (representing each columns's units content in the spreadsheet).
-    Return the number of True-Positives and False-Positives and update (delete elements from) the dicts. '''
-
-    c_tp, c_fp = 0, 0
-
-    for c_ka, c_va in actual_col.items():
-        if c_ka not in expected_col:
-            ''' we detected units in this cell but nothing is there
-            count number of unit instances in this cell and add to fp '''
-            c_fp += count_number_of_unit_instances_in_cell(c_va, 'fp')
-            # skip to next cell
-            continue
-        # cell-dict exists in both actual and expected, check cell-lists
-        c_tp += compare_cell_lists(c_va, expected_col[c_ka])
-
-    return (c_tp, c_fp)
-
-def compare_actual_with_expected_sheets(actual_sh, expected_sh):
-    ''' Compare two given dictionaries (representing each sheet's units content in the spreadsheet).
-    Return the number of True-Positives and False-Positives and update (delete elements from) the dicts. '''
-
-    col_tp, col_fp = 0, 0
-
-    for col_ka, col_va in actual_sh.items():
-        if col_ka not in expected_sh:
-            ''' we detected units in this column but nothing is there
-            count number of unit instances in this column and add to fp '''
-            col_fp += count_number_of_unit_instances_in_column(col_va, 'fp')
-            # skip to next column
-            continue
-        # column-dict exists in both actual and expected, check cells
-        res = compare_actual_with_expected_columns(col_va, expected_sh[col_ka])
-        col_tp += res[0]
-        col_fp += res[1]
-
-    return (col_tp, col_fp)
-
-def compare_actual_with_expected_dicts(actual, expected):
-    ''' Compare two given dictionaries (representing each file's units, the actual and the expected).
+    Each actual part (in order) is matched with the first unmatched expected part of the same key (see get_part_match_key).
+    Return the lists of matched (actual) parts, spurious (unmatched actual) parts and missing (unmatched expected) parts,
+    the given lists are not changed. '''
+
+    expected_counts = Counter(get_part_match_key(atmu, match_attrs) for cu in expected_cell_lst for atmu in cu['parts'])
+    matched_counts = Counter()
+    matched, spurious, missing = list(), list(), list()
+    # iterate over each atomic unit in each compound unit (actual)
+    for compound_unit in actual_cell_lst:
+        for atmu in compound_unit['parts']:
+            key = get_part_match_key(atmu, match_attrs)
+            if matched_counts[key] < expected_counts[key]:
+                matched_counts[key] += 1
+                matched.append(atmu)
+            else:
+                spurious.append(atmu)
+    # the first matched_counts[key] parts of each key were matched (expected)
+    for compound_unit in expected_cell_lst:
+        for atmu in compound_unit['parts']:
+            key = get_part_match_key(atmu, match_attrs)
+            if matched_counts[key] > 0:
+                matched_counts[key] -= 1
+            else:
+                missing.append(atmu)
+
+    return matched, spurious, missing
+
+def diff_actual_with_expected_dicts(actual, expected, match_attrs=PART_MATCH_ATTRS):
+    ''' Compare two given dictionaries (representing each file's units, the actual and the expected), without changing them.
+    Return a structured diff {sheet: {column: {row: cell diff}}} over the cells of both, each cell diff holding the lists of
+    'matched', 'spurious' and 'missing' parts (see diff_cell_lists) and whether the cell is 'unexpected' (an expected
+    dictionary was given, and the cell is not in it). Actual cells come first (in order), then expected-only cells. '''
+
+    diff = dict()
+    for sheet_ka, sheet_va in (actual or dict()).items():
+        sheet_ve = expected.get(sheet_ka, dict()) if expected else dict()
+        for col_ka, col_va in sheet_va.items():
+            col_ve = sheet_ve.get(col_ka, dict())
+            for c_ka, c_va in col_va.items():
+                matched, spurious, missing = diff_cell_lists(c_va, col_ve.get(c_ka, list()), match_attrs)
+                diff.setdefault(sheet_ka, dict()).setdefault(col_ka, dict())[c_ka] = \
+                    {'matched': matched, 'spurious': spurious, 'missing': missing, 'unexpected': bool(expected) and c_ka not in col_ve}
+    for sheet_ke, sheet_ve in (expected or dict()).items():
+        for col_ke, col_ve in sheet_ve.items():
+            for c_ke, c_ve in col_ve.items():
+                col_diff = diff.setdefault(sheet_ke, dict()).setdefault(col_ke, dict())
+                if c_ke not in col_diff:
+                    col_diff[c_ke] = {'matched': list(), 'spurious': list(), 'missing': [atmu for cu in c_ve for atmu in cu['parts']], \
+                                      'unexpected': False}
+
+    return diff
+
+def iter_diff_cells(diff):
+    ''' Iterate over the (sheet, column, row, cell diff) tuples of a structured diff. '''
+
+    for sheet_n, sheet_d in diff.items():
+        for col_n, col_d in sheet_d.items():
+            for row_n, cell_diff in col_d.items():
+                yield sheet_n, col_n, row_n, cell_diff
+
+def get_diff_counts(diff):
+    ''' Return the number of True-Positives, False-Positives and False-Negatives of a structured diff.
+    As in the original (destructive) comparison, the units of unexpected cells are counted twice as False-Positives. '''
+
+    tp, fp, fn = 0, 0, 0
+    for _, _, _, cell_diff in iter_diff_cells(diff):
+        tp += len(cell_diff['matched'])
+        fp += len(cell_diff['spurious']) * (2 if cell_diff['unexpected'] else 1)
+        fn += len(cell_diff['missing'])
+    return tp, fp, fn
+
+def append_diff_to_debug_dict(diff, expected):
+    ''' Update debug dictionary with the per-unit records ('tp', 'fp', 'fn') of a structured diff (of a given expected dictionary),
+    in the order of the original comparison: matches and unexpected cells, then leftovers of the actual and of the expected. '''
+
+    for _, _, _, cell_diff in iter_diff_cells(diff):
+        for atmu in (cell_diff['spurious'] if cell_diff['unexpected'] else cell_diff['matched']):
+            append_to_debug_dict(atmu, 'fp' if cell_diff['unexpected'] else 'tp')
+    for _, _, _, cell_diff in iter_diff_cells(diff):
+        for atmu in cell_diff['spurious']:
+            append_to_debug_dict(atmu, 'fp')
+    for sheet_ke, sheet_ve in (expected or dict()).items():
+        for col_ke, col_ve in sheet_ve.items():
+            for c_ke in col_ve:
+                for atmu in diff[sheet_ke][col_ke][c_ke]['missing']:
+                    append_to_debug_dict(atmu, 'fn')
+
+def compare_actual_with_expected_dicts(actual, expected, match_attrs=PART_MATCH_ATTRS):
+    ''' Compare two given dictionaries (representing each file's units, the actual and the expected), without changing them.
     Return the number of True-Positives, False-Positives and False-Negatives. '''
 
-    sh_tp, sh_fp, sh_fn = 0, 0, 0
-
-    if actual and expected:
-        for sheet_ka, sheet_va in actual.items():
-            if sheet_ka not in expected:
-                ''' we detected units in this sheeet but nothing is there
-                count number of unit instances in this sheet and add to fp '''
-                sh_fp += count_number_of_unit_instances_in_sheet(sheet_va, 'fp')
-                # skip to next sheet
-                continue
-            # sheet-dict exists in both actual and expected, check columns
-            res = compare_actual_with_expected_sheets(sheet_va, expected[sheet_ka])
-            sh_tp += res[0]
-            sh_fp += res[1]
-
-    # go over leftovers in actual an add to fp (those we recognized incorrectly)
-    if actual:
-        for _, sheet_va in actual.items():
-            sh_fp += count_number_of_unit_instances_in_sheet(sheet_va, 'fp')
-
-    # go over lefovers in expected and add to fn
-    if expected:
-        for _, sheet_ve in expected.items():
-            sh_fn += count_number_of_unit_instances_in_sheet(sheet_ve, 'fn')
+    global g_err_dbg
 
-    return sh_tp, sh_fp, sh_fn
+    diff = diff_actual_with_expected_dicts(actual, expected, match_attrs)
+    # --- debug prints for errors dict ----------
+    if g_err_dbg:
+        append_diff_to_debug_dict(diff, expected)
+    # -------------------------------------------
+    return get_diff_counts(diff)
 
 def calc_and_print_stats(true_pos, false_pos, false_neg, color='c'):
     ''' Calculate and print validation statistics (Precision, Recall, F1, etc...). '''
@@ -234,19 +224,130 @@ def print_debug_dict(fdebug_file):
                     + str(file_inst['fp']) + "," + str(file_inst['fn']) + "\n")
         fclrprint(f'Dumped debug results to files {fdebug_file_units}, {fdebug_file_files}', 'c')
 
-def ccut_test_xlsx_files_in_dir(input_dir_name, output_debug_file):
-    ''' Process the xlsx files in a given directory and match against its given validation file. '''
+def merge_debug_dicts(total_dict, other_dict):
+    ''' Add the per-unit (or per-file) tp/fp/fn counts of other_dict into total_dict. '''
+
+    for key, counts in other_dict.items():
+        if key not in total_dict:
+            total_dict[key] = {'tp': 0, 'fp': 0, 'fn': 0}
+        for debug_class in ['tp', 'fp', 'fn']:
+            total_dict[key][debug_class] += counts[debug_class]
+
+def init_validation_worker(output_debug_file, cache_file, maps_snapshot_file=None):
+    ''' Initialize globals of a worker process (each worker holds its own ccut instance). '''
+
+    init_globals(cache_file, maps_snapshot_file)
+    init_ccut_validation(output_debug_file)
+
+def get_file_digest(fname):
+    ''' Return the sha1 digest of the content of a file. '''
+
+    hsh = sha1()
+    with open(fname, 'rb') as read_file:
+        for chunk in iter(lambda: read_file.read(1 << 20), b''):
+            hsh.update(chunk)
+    return hsh.hexdigest()
+
+def get_extraction_cache_fname(xfname_full):
+    return xfname_full.split('.xlsx')[0] + EXTRACTION_CACHE_EXT
 
-    global g_err_dbg, g_err_dct_p_file, g_ignore_articles, g_list_of_ignored_articles
+def load_cached_extraction(xfname_full, file_digest, fingerprint):
+    ''' Return the extraction results cached next to an xlsx file ({'annotations', 'sheets', 'skipped', ...}),
+    or None if there are none for this file content (digest) and extraction pipeline (fingerprint).
+    Annotations are cached in the columnar format (see ColumnarAnnotations). '''
 
-    init_globals()
+    try:
+        with open(get_extraction_cache_fname(xfname_full), 'r') as read_file:
+            cached = load(read_file)
+    except (OSError, ValueError):
+        return None
+    if cached.get('digest') != file_digest or cached.get('fingerprint') != fingerprint:
+        return None
+    try:
+        if cached['annotations'] is not None:
+            cached['annotations'] = ColumnarAnnotations.from_json_obj(cached['annotations']).to_dict()
+    except (KeyError, TypeError, ValueError):
+        return None # written by an older version
+    return cached
+
+def store_cached_extraction(xfname_full, file_digest, fingerprint, act_dict, num_of_sheets, num_of_skipped_cells):
+    ''' Cache the extraction results of an xlsx file next to it (see load_cached_extraction). '''
+
+    annotations = ColumnarAnnotations.from_dict(act_dict).to_json_obj() if act_dict is not None else None
+    with atomic_open(get_extraction_cache_fname(xfname_full)) as outfile:
+        dump({'digest': file_digest, 'fingerprint': fingerprint, 'annotations': annotations, \
+              'sheets': num_of_sheets, 'skipped': num_of_skipped_cells}, outfile)
+
+def ccut_test_xlsx_file(file_task):
+    ''' Process a single xlsx file and match against its given validation file.
+    file_task is a tuple of (xlsx filename, validation filename, process_file keyword options, extraction fingerprint).
+    If the extraction fingerprint is given, extraction results are cached next to the xlsx file and reused while
+    the file and the fingerprint are unchanged (see get_extraction_fingerprint).
+    Return a dictionary with the file's tp/fp/fn, its per-unit debug counts ('units'), the number of
+    sheets processed ('sheets'), the number of cells skipped outside header regions ('skipped'), the cell parse cache counters for this file ('cache')
+    and whether cached extraction results were used ('extraction_cached'). '''
+
+    global g_err_dct_p_unit
+
+    xfname_full, vfname_full, process_file_options, extraction_fingerprint = file_task
+    # collect per-unit debug counts of this file only (merged by the caller)
+    g_err_dct_p_unit = dict()
+    sheets_before = get_tot_num_of_sheets()
+    skipped_before = get_tot_num_of_skipped_cells()
+    cache_before = get_cell_cache_stats()
+
+    cached = None
+    if extraction_fingerprint:
+        file_digest = get_file_digest(xfname_full)
+        cached = load_cached_extraction(xfname_full, file_digest, extraction_fingerprint)
+    if cached:
+        fclrprint(f'Using cached extraction of file {xfname_full} and comparing results to {vfname_full}')
+        act_dict, num_of_sheets, num_of_skipped_cells = cached['annotations'], cached['sheets'], cached['skipped']
+    else:
+        fclrprint(f'Processing file {xfname_full} and comparing results to {vfname_full}')
+        act_dict, _ = process_file(xfname_full, keep_raw_sheets=False, **process_file_options)
+        num_of_sheets = get_tot_num_of_sheets() - sheets_before
+        num_of_skipped_cells = get_tot_num_of_skipped_cells() - skipped_before
+        if extraction_fingerprint:
+            store_cached_extraction(xfname_full, file_digest, extraction_fingerprint, act_dict, num_of_sheets, num_of_skipped_cells)
+    val_dict = load_journaled_annotation_file(vfname_full)
+    f_tp, f_fp, f_fn = compare_actual_with_expected_dicts(act_dict, val_dict)
+    flush_persistent_cache()
+
+    cache_after = get_cell_cache_stats()
+    cache_delta = {k: cache_after[k] - cache_before[k] for k in ['hits', 'misses', 'evictions']}
+    return {'tp': f_tp, 'fp': f_fp, 'fn': f_fn, 'units': g_err_dct_p_unit,
+            'sheets': num_of_sheets, 'skipped': num_of_skipped_cells, 'cache': cache_delta, 'extraction_cached': cached is not None}
+
+def ccut_test_xlsx_files_in_dir(input_dir_name, output_debug_file, cache_file=None, num_of_jobs=1, process_file_options=None, \
+                                maps_snapshot_file=None, extraction_cache=False):
+    ''' Process the xlsx files in a given directory and match against its given validation file.
+    If num_of_jobs > 1, files are processed by a pool of worker processes (results are merged in directory order).
+    process_file_options are passed on as keyword arguments to process_file.
+    If maps_snapshot_file is given, CCUT's maps are loaded from (or saved to) this snapshot (see init_globals).
+    If extraction_cache is set, the extraction results of each file are cached next to it (see ccut_test_xlsx_file). '''
+
+    global g_err_dbg, g_err_dct_p_unit, g_err_dct_p_file, g_ignore_articles, g_list_of_ignored_articles
+
+    if process_file_options is None:
+        process_file_options = dict()
+    # with workers, each one opens the cache file itself (see init_validation_worker), a connection opened here
+    # would be inherited by the forked workers
+    init_globals(cache_file if num_of_jobs <= 1 else None, maps_snapshot_file)
     init_ccut_validation(output_debug_file)
     true_pos, false_pos, false_neg = 0, 0, 0
+    err_dct_p_unit = dict()
+    tot_num_of_sheets = 0
+    tot_num_of_skipped_cells = 0
+    cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+    num_of_cached_extractions = 0
+    extraction_fingerprint = get_extraction_fingerprint(process_file_options) if extraction_cache else None
 
     tot_files = get_num_of_files_in_dir(input_dir_name, ".xlsx")
     files_processed = 0
     actual_files_processed = 0
-    start = time()
+    # collect files to process (with their position in the directory, for progress reporting)
+    file_tasks, file_positions, file_names = list(), list(), list()
     for xfname in listdir(input_dir_name):
         if xfname.endswith(".xlsx"):
             files_processed += 1
@@ -261,31 +362,60 @@ def ccut_test_xlsx_files_in_dir(input_dir_name, output_debug_file):
             if not exists(vfname_full):
                 fclrprint(f'File {xfname_full} does not have a results file. Skipping...', 'r')
                 continue
-            fclrprint(f'Processing file {xfname_full} and comparing results to {vfname_full}')
-            act_dict, _ = process_file(xfname_full)
-            #import IPython; IPython.embed();
-            with open(vfname_full, 'r') as read_file:
-                val_dict = load(read_file)
-            f_tp, f_fp, f_fn = compare_actual_with_expected_dicts(act_dict, val_dict)
-            # update debug dictionary
-            if g_err_dbg:
-                g_err_dct_p_file[xfname] = dict()
-                g_err_dct_p_file[xfname]['tp'] = f_tp
-                g_err_dct_p_file[xfname]['fp'] = f_fp
-                g_err_dct_p_file[xfname]['fn'] = f_fn
-            # add to total
-            true_pos += f_tp
-            false_pos += f_fp
-            false_neg += f_fn
-            if (files_processed % 10) == 0:
-                eta = (tot_files - files_processed) * (time() - start) / files_processed
-                eta = str(timedelta(seconds=int(eta))).zfill(8)
-                print('Completion: %04.2f%%, eta: %s' % (100 * files_processed / tot_files, eta))
-                calc_and_print_stats(true_pos, false_pos, false_neg)
+            file_tasks.append((xfname_full, vfname_full, process_file_options, extraction_fingerprint))
+            file_positions.append(files_processed)
+            file_names.append(xfname)
+
+    start = time()
+    executor = None
+    if num_of_jobs > 1:
+        if maps_snapshot_file:
+            # write the snapshot once, before the workers load it
+            get_ccut_instance()
+        executor = ProcessPoolExecutor(max_workers=num_of_jobs, initializer=init_validation_worker, \
+                                       initargs=(output_debug_file, cache_file, maps_snapshot_file))
+        file_results = executor.map(ccut_test_xlsx_file, file_tasks)
+    else:
+        file_results = map(ccut_test_xlsx_file, file_tasks)
+
+    # results are consumed in directory order, so merging is deterministic
+    for xfname, file_position, file_res in zip(file_names, file_positions, file_results):
+        f_tp, f_fp, f_fn = file_res['tp'], file_res['fp'], file_res['fn']
+        # update debug dictionary
+        if g_err_dbg:
+            g_err_dct_p_file[xfname] = dict()
+            g_err_dct_p_file[xfname]['tp'] = f_tp
+            g_err_dct_p_file[xfname]['fp'] = f_fp
+            g_err_dct_p_file[xfname]['fn'] = f_fn
+            merge_debug_dicts(err_dct_p_unit, file_res['units'])
+        tot_num_of_sheets += file_res['sheets']
+        tot_num_of_skipped_cells += file_res['skipped']
+        for k in cache_stats:
+            cache_stats[k] += file_res['cache'][k]
+        num_of_cached_extractions += file_res['extraction_cached']
+        # add to total
+        true_pos += f_tp
+        false_pos += f_fp
+        false_neg += f_fn
+        if (file_position % 10) == 0:
+            eta = (tot_files - file_position) * (time() - start) / file_position
+            eta = str(timedelta(seconds=int(eta))).zfill(8)
+            print('Completion: %04.2f%%, eta: %s' % (100 * file_position / tot_files, eta))
+            calc_and_print_stats(true_pos, false_pos, false_neg)
+
+    if executor:
+        executor.shutdown()
+    g_err_dct_p_unit = err_dct_p_unit
 
     calc_and_print_stats(true_pos, false_pos, false_neg, color='g')
-    print(f'Processed a total of {actual_files_processed} files ({get_tot_num_of_sheets()} sheets) out of {files_processed} .xlsx files in given directory {input_dir_name}!')
+    print(f'Processed a total of {actual_files_processed} files ({tot_num_of_sheets} sheets) out of {files_processed} .xlsx files in given directory {input_dir_name}!')
+    if process_file_options.get('header_only'):
+        print(f'Skipped a total of {tot_num_of_skipped_cells} cells outside header regions')
+    print(f'Cell parse cache: {cache_stats["hits"]} hits, {cache_stats["misses"]} misses, {cache_stats["evictions"]} evictions')
+    if extraction_cache:
+        print(f'Extraction cache: reused the results of {num_of_cached_extractions} out of {len(file_tasks)} files')
     print_debug_dict(output_debug_file)
+    close_persistent_cache()
 
 if __name__ == '__main__':
     main()
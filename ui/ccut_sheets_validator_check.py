@@ -0,0 +1,151 @@
+from argparse import ArgumentParser
+from baselutils import fclrprint
+from copy import deepcopy
+from os.path import basename
+from random import Random
+
+import ccut_sheets_validator
+
+# unit URIs drawn for the generated parts (a small pool, so that cells share units)
+CHECK_UNIT_URIS = [f'http://www.qudt.org/qudt/owl/1.0.0/unit/Instances.html#Unit{idx}' for idx in range(6)]
+
+# --- entrypoint --------------------------------------------------------------
+
+def main():
+    ap = ArgumentParser(description=f'Check the validator\'s matcher against the original (rescanning) one over randomized annotation dictionaries.\n\tUSAGE: python {basename(__file__)} -n TRIALS')
+    ap.add_argument('-n', '--trials', help='number of (actual, expected) dictionary pairs to compare on (default: 5000).', type=int, default=5000)
+    ap.add_argument('--seed', help='random seed (default: 0).', type=int, default=0)
+    args = ap.parse_args()
+
+    mismatches = check_matcher(args.trials, args.seed)
+    if mismatches:
+        for mismatch in mismatches[:5]:
+            fclrprint(f'Mismatch: {mismatch}', 'r')
+        fclrprint(f'The matcher differs from the original one on {len(mismatches)}/{args.trials} dictionary pairs', 'r')
+        exit(1)
+    fclrprint(f'Done... the matcher agrees with the original one on {args.trials} dictionary pairs (counts, per-unit records and their order)', 'g')
+
+# --- original matcher --------------------------------------------------------
+
+def baseline_count_parts(cell_lists, debug_dict, debug_class):
+    ''' Return the number of parts in the given cell lists, recording each of them in debug_dict (as debug_class). '''
+
+    total_u = 0
+    for cell in cell_lists:
+        for compound_unit in cell:
+            total_u += len(compound_unit['parts'])
+            for atmu in compound_unit['parts']:
+                record_part(debug_dict, atmu, debug_class)
+    return total_u
+
+def baseline_find_match(actual_cell_lst, expected_cell_lst):
+    ''' Return the indexes (compound unit, part) in both lists of the first pair of parts of the same unit URI, or None. '''
+
+    for idx_cl1, cl1 in enumerate(actual_cell_lst):
+        for idx_al1, al1 in enumerate(cl1['parts']):
+            for idx_cl2, cl2 in enumerate(expected_cell_lst):
+                for idx_al2, al2 in enumerate(cl2['parts']):
+                    if al1['u'] == al2['u']:
+                        return idx_cl1, idx_al1, idx_cl2, idx_al2
+    return None
+
+def baseline_compare_cell_lists(actual_cell_lst, expected_cell_lst, debug_dict):
+    ''' The original cell comparison: rescan both lists for the first matching pair of parts and delete it,
+    until no pair matches. Return the number of True-Positives. '''
+
+    tp = 0
+    while True:
+        match = baseline_find_match(actual_cell_lst, expected_cell_lst)
+        if match is None:
+            return tp
+        c_a_idx, a_a_idx, c_e_idx, a_e_idx = match
+        record_part(debug_dict, actual_cell_lst[c_a_idx]['parts'].pop(a_a_idx), 'tp')
+        expected_cell_lst[c_e_idx]['parts'].pop(a_e_idx)
+        tp += 1
+
+def baseline_compare_dicts(actual, expected, debug_dict):
+    ''' The original (destructive) dictionary comparison: match the cells of both, then count the leftovers of the
+    actual as False-Positives (along with the units of unexpected sheets, columns and cells, which are thus counted twice)
+    and the leftovers of the expected as False-Negatives. Return the number of True-Positives, False-Positives and False-Negatives. '''
+
+    tp, fp, fn = 0, 0, 0
+    if actual and expected:
+        for sheet_ka, sheet_va in actual.items():
+            if sheet_ka not in expected:
+                fp += baseline_count_parts([cell for col in sheet_va.values() for cell in col.values()], debug_dict, 'fp')
+                continue
+            for col_ka, col_va in sheet_va.items():
+                if col_ka not in expected[sheet_ka]:
+                    fp += baseline_count_parts(col_va.values(), debug_dict, 'fp')
+                    continue
+                for c_ka, c_va in col_va.items():
+                    if c_ka not in expected[sheet_ka][col_ka]:
+                        fp += baseline_count_parts([c_va], debug_dict, 'fp')
+                        continue
+                    tp += baseline_compare_cell_lists(c_va, expected[sheet_ka][col_ka][c_ka], debug_dict)
+    if actual:
+        fp += baseline_count_parts([cell for sheet in actual.values() for col in sheet.values() for cell in col.values()], debug_dict, 'fp')
+    if expected:
+        fn += baseline_count_parts([cell for sheet in expected.values() for col in sheet.values() for cell in col.values()], debug_dict, 'fn')
+    return tp, fp, fn
+
+def record_part(debug_dict, atomic_unit, debug_class):
+    ''' Count an atomic unit in a per-unit debug dictionary (as in append_to_debug_dict). '''
+
+    debug_dict.setdefault(atomic_unit['u'], {'tp': 0, 'fp': 0, 'fn': 0})[debug_class] += 1
+
+# --- randomized check --------------------------------------------------------
+
+def generate_cell(rnd):
+    ''' Return a cell: a list of compound units, each holding a few parts (units, sometimes with a prefix or an exponent). '''
+
+    cell = list()
+    for _ in range(rnd.randint(1, 3)):
+        parts = list()
+        for _ in range(rnd.randint(0, 6)):
+            part = {'u': rnd.choice(CHECK_UNIT_URIS)}
+            if rnd.random() < 0.2:
+                part['e'] = rnd.choice(['2', '-1'])
+            parts.append(part)
+        cell.append({'parts': parts})
+    return cell
+
+def generate_annotations(rnd):
+    ''' Return a dictionary of annotations {sheet: {column: {row: cell}}} over a few sheets, columns and rows
+    (so that generated dictionaries overlap). '''
+
+    return {f'Sheet{sheet_idx}': {col: {str(row): generate_cell(rnd) for row in rnd.sample(range(1, 7), rnd.randint(0, 4))} \
+                                  for col in rnd.sample('ABCDE', rnd.randint(0, 4))} \
+            for sheet_idx in rnd.sample(range(4), rnd.randint(0, 3))}
+
+def check_matcher(num_of_trials, seed):
+    ''' Compare the validator's matcher (compare_actual_with_expected_dicts) with the original one over randomized
+    (actual, expected) pairs: counts and per-unit debug records (including their order) must be identical, and the
+    validator must not change its inputs. Return the list of mismatching pairs. '''
+
+    rnd = Random(seed)
+    mismatches = list()
+    for _ in range(num_of_trials):
+        actual, expected = generate_annotations(rnd), generate_annotations(rnd)
+        kind = rnd.random()
+        if kind < 0.3:
+            expected = deepcopy(actual) # mostly matches
+        elif kind < 0.35:
+            expected = None # no expected file
+        elif kind < 0.4:
+            actual = dict() # nothing extracted
+
+        baseline_debug = dict()
+        baseline_counts = baseline_compare_dicts(deepcopy(actual), deepcopy(expected), baseline_debug)
+
+        ccut_sheets_validator.init_ccut_validation('debug') # keep per-unit records
+        inputs = deepcopy((actual, expected))
+        counts = ccut_sheets_validator.compare_actual_with_expected_dicts(actual, expected)
+        debug = ccut_sheets_validator.g_err_dct_p_unit
+
+        if counts != baseline_counts or list(debug.items()) != list(baseline_debug.items()) or (actual, expected) != inputs:
+            mismatches.append({'actual': inputs[0], 'expected': inputs[1], 'counts': counts, 'baseline_counts': baseline_counts})
+    return mismatches
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+from annotate import add_annotation_to_cell, get_column_row_from_cell_string, update_cell_dimension, remove_annotation
+from atomic_file import atomic_write, file_lock
+from ccut_cache import LRUCache
+from ccut_columnar import read_annotation_file, get_annotation_file_content, get_annotation_file_format
+from copy import deepcopy
+from json import dumps, loads
+from os import SEEK_END, fsync, remove, stat
+from os.path import exists
+from threading import RLock
+
+# extension of the journal file kept next to an annotation file (json), and of its lock file
+EDIT_JOURNAL_EXT = '.journal'
+EDIT_JOURNAL_LOCK_EXT = '.lock'
+# number of journaled edits from which a save compacts the journal into the annotation file
+EDIT_JOURNAL_COMPACT_SIZE = 200
+# edit operations
+EDIT_ADD = 'add'
+EDIT_REMOVE = 'remove'
+
+def get_file_version(fname):
+    ''' Return the version of a file, as [size, modification time (ns)]: it changes whenever the file is rewritten. '''
+
+    file_stat = stat(fname)
+    return [file_stat.st_size, file_stat.st_mtime_ns]
+
+def apply_edit(ant_dict, edit):
+    ''' Apply an edit to a given dictionary of annotations:
+    {"op": "add", "sheet", "cell", "m", "p", "u", "e"} (see add_annotation_to_cell), or
+    {"op": "remove", "sheet", "column", "row", "index"} (see remove_annotation, returns what was removed). '''
+
+    if edit['op'] == EDIT_ADD:
+        add_annotation_to_cell(ant_dict, edit['sheet'], edit['cell'], edit['m'], edit['p'], edit['u'], edit['e'])
+        update_cell_dimension(ant_dict, edit['sheet'], edit['cell'])
+        return None
+    elif edit['op'] == EDIT_REMOVE:
+        return remove_annotation(ant_dict, edit['sheet'], edit.get('column'), edit.get('row'), edit.get('index'))
+    raise ValueError(f'unknown edit operation {edit["op"]}')
+
+def check_edit(ant_dict, edit):
+    ''' Raise the error applying an edit to a given dictionary of annotations would raise (i.e., a KeyError for a
+    missing element, a ValueError for a non-numeric exponent), if any. The dictionary is left unchanged: the edit
+    is applied to a copy of the cell it changes (or to a shallow copy of the sheet, for a sheet removal). '''
+
+    sheet = edit['sheet']
+    if edit['op'] == EDIT_ADD:
+        col, row = get_column_row_from_cell_string(edit['cell'])
+    else:
+        col, row = edit.get('column'), edit.get('row')
+    scope = dict()
+    if sheet in ant_dict:
+        if col is None or row is None:
+            scope[sheet] = dict(ant_dict[sheet])
+        else:
+            scope[sheet] = dict()
+            if row in ant_dict[sheet].get(col, dict()):
+                scope[sheet][col] = {row: deepcopy(ant_dict[sheet][col][row])}
+    apply_edit(scope, edit)
+
+class EditJournal:
+    ''' An append-only log of the edits of an annotation file (json), kept next to it (fname.journal).
+    Each edit is appended (and fsync-ed) as a json line, so keeping the edits costs O(changes) instead of
+    rewriting the whole file; load replays the journal onto the file, and compact rewrites the file (once) and
+    drops the journal. The journal's first line identifies the version (size, mtime) of the file it applies to,
+    a journal left from another version (i.e., a crash right after compaction, a re-upload) is ignored. '''
+
+    def __init__(self, json_fname):
+        self.json_fname = json_fname
+        self.fname = json_fname + EDIT_JOURNAL_EXT
+        self.lock_fname = self.fname + EDIT_JOURNAL_LOCK_EXT
+
+    def get_snapshot_version(self):
+        ''' Return the version of the annotation file (see get_file_version), the journal only applies to this version. '''
+
+        return get_file_version(self.json_fname)
+
+    def is_current(self):
+        ''' Return True if there is a journal for this version of the file. '''
+
+        if not exists(self.fname) or not exists(self.json_fname):
+            return False
+        with open(self.fname, 'r') as read_file:
+            try:
+                header = loads(read_file.readline())
+            except ValueError:
+                return False
+        return header.get('snapshot') == self.get_snapshot_version()
+
+    def read_edits(self):
+        ''' Return the list of journaled edits (empty if there is no journal for this version of the file). '''
+
+        return self.read_edits_since(0)[0]
+
+    def read_edits_since(self, offset):
+        ''' Return the edits journaled from a given offset of the journal on (0: all of them), and the offset
+        they end at (only complete lines are read, an edit being appended is read on the next call). '''
+
+        if not self.is_current():
+            return list(), 0
+        with open(self.fname, 'rb') as read_file:
+            if offset == 0:
+                read_file.readline() # header
+            else:
+                read_file.seek(offset)
+            offset = read_file.tell()
+            content = read_file.read()
+        content = content[:content.rfind(b'\n')+1]
+        edits = list()
+        for line in content.splitlines():
+            try:
+                edits.append(loads(line))
+            except ValueError:
+                pass # a partially written line, left by a crash
+        return edits, offset + len(content)
+
+    def get_num_of_edits(self):
+        return len(self.read_edits())
+
+    def append(self, edit):
+        ''' Append an (already applied) edit to the journal, it is on disk once this returns.
+        Return the offset of the end of the journal (see read_edits_since). '''
+
+        if exists(self.fname) and not self.is_current():
+            self.discard() # left from another version of the file
+        with open(self.fname, 'a+b') as outfile:
+            outfile.seek(0, SEEK_END)
+            if outfile.tell() == 0:
+                outfile.write((dumps({'snapshot': self.get_snapshot_version()}) + '\n').encode())
+            else:
+                outfile.seek(-1, SEEK_END)
+                if outfile.read(1) != b'\n':
+                    outfile.write(b'\n') # end a partially written line, left by a crash
+            outfile.write((dumps(edit) + '\n').encode())
+            outfile.flush()
+            fsync(outfile.fileno())
+            return outfile.tell()
+
+    def load(self):
+        ''' Return the dictionary of annotations of the file, with the journaled edits replayed onto it. '''
+
+        ant_dict = read_annotation_file(self.json_fname) or dict()
+        if exists(self.fname) and not self.is_current():
+            self.discard() # left from another version of the file
+        for edit in self.read_edits():
+            apply_edit(ant_dict, edit)
+        return ant_dict
+
+    def compact(self, ant_dict):
+        ''' Write a given dictionary of annotations (the file with its edits applied) to the file (in its format), and drop the journal. '''
+
+        # a crash leaves either the old file and its journal or the new file (and a journal of an older version)
+        atomic_write(self.json_fname, get_annotation_file_content(ant_dict, get_annotation_file_format(self.json_fname)), sync=True)
+        self.discard()
+
+    def discard(self):
+        if exists(self.fname):
+            remove(self.fname)
+
+class AnnotationFileCache:
+    ''' The dictionaries of annotations of recently used annotation files (with their journaled edits replayed), kept
+    in memory so that each request does not load a whole file. A lookup brings the dictionary up to date with its
+    file: it is reloaded if the file changed (i.e., compacted, uploaded again), otherwise only the edits journaled
+    since the last lookup (by any worker process) are replayed onto it.
+    Edits and compactions of a file are serialized by a lock on its journal (across worker processes), each
+    being made on an up to date dictionary. Returned dictionaries must only be changed through apply_edit. '''
+
+    def __init__(self, max_size):
+        self.entries = LRUCache(max_size) # file name -> {'version': file version, 'offset': journal offset, 'ant_dict'}
+        self.lock = RLock()
+
+    def get_entry(self, json_fname):
+        ''' Return the (up to date) cache entry of an annotation file. '''
+
+        journal = EditJournal(json_fname)
+        version = journal.get_snapshot_version()
+        entry = self.entries.get(json_fname)
+        if entry is None or entry['version'] != version:
+            entry = {'version': version, 'offset': 0, 'ant_dict': read_annotation_file(json_fname) or dict()}
+            self.entries.put(json_fname, entry)
+        edits, entry['offset'] = journal.read_edits_since(entry['offset'])
+        for edit in edits:
+            apply_edit(entry['ant_dict'], edit)
+        return entry
+
+    def get(self, json_fname):
+        ''' Return the dictionary of annotations of a file, with its journaled edits replayed onto it. '''
+
+        with self.lock:
+            return self.get_entry(json_fname)['ant_dict']
+
+    def apply_edit(self, json_fname, edit):
+        ''' Journal an edit of the dictionary of annotations of a file, and apply it (see apply_edit).
+        An edit which cannot be applied raises its error (see check_edit) before anything is changed or journaled. '''
+
+        journal = EditJournal(json_fname)
+        with self.lock, file_lock(journal.lock_fname):
+            entry = self.get_entry(json_fname)
+            check_edit(entry['ant_dict'], edit)
+            offset = journal.append(edit)
+            result = apply_edit(entry['ant_dict'], edit)
+            entry['offset'] = offset
+            return result
+
+    def compact(self, json_fname, min_num_of_edits=0):
+        ''' Compact the journal of a file into it (see EditJournal.compact), if it holds at least min_num_of_edits edits. '''
+
+        journal = EditJournal(json_fname)
+        with self.lock, file_lock(journal.lock_fname):
+            if journal.get_num_of_edits() < max(min_num_of_edits, 1):
+                return
+            entry = self.get_entry(json_fname)
+            journal.compact(entry['ant_dict'])
+            entry['version'], entry['offset'] = journal.get_snapshot_version(), 0
+
+def load_journaled_annotation_file(json_fname):
+    ''' Load an annotation file (json), along with the edits journaled next to it (see EditJournal) '''
+
+    return EditJournal(json_fname).load()
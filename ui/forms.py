@@ -2,7 +2,7 @@
 
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileRequired
-from wtforms import StringField, SubmitField
+from wtforms import SelectField, StringField, SubmitField
 from wtforms.validators import DataRequired
 
 class ParseForm(FlaskForm):
@@ -19,6 +19,10 @@ class FileUploadForm(FlaskForm):
     in_file  = FileField(validators=[FileRequired()])
     submit   = SubmitField('Upload')
 
+class SpreadsheetUploadForm(FileUploadForm):
+    out_format = SelectField('Annotation file format', choices=[('json', 'json'), ('columnar', 'columnar json'), \
+                                                                ('columnar.gz', 'compressed columnar json'), ('msgpack', 'msgpack')])
+
 class AnnotationEditForm(FlaskForm):
     q_sheet  = StringField('Sheet', validators=[DataRequired()])
     cell     = StringField('Cell',  validators=[DataRequired()])
@@ -0,0 +1,136 @@
+from collections import Counter, defaultdict
+from fuzzywuzzy.fuzz import WRatio
+from fuzzywuzzy.process import extract
+from fuzzywuzzy.utils import full_process, intr
+from heapq import heappush, heapreplace
+
+def process_choice(choice):
+    ''' Return a string as scored by fuzzywuzzy.process.extract (with its default processor and scorer). '''
+
+    return full_process(full_process(choice), force_ascii=True)
+
+class ChoiceProfile:
+    ''' A processed string and its sorted (and sorted unique) tokens, as compared by fuzzywuzzy's token ratios,
+    with their character counts, used to bound the WRatio score of two strings (see get_score_bound). '''
+
+    def __init__(self, processed_str):
+        tokens = processed_str.split()
+        self.tokens = set(tokens)
+        self.num_of_tokens = len(tokens)
+        self.num_of_spaces = processed_str.count(' ')
+        self.strs = [processed_str, ' '.join(sorted(tokens)), ' '.join(sorted(self.tokens))]
+        self.letter_counts = Counter(processed_str.replace(' ', ''))
+        self.char_counts = [Counter(self.strs[0])]
+        for idx in [1, 2]:
+            self.char_counts.append(self.char_counts[idx-1] if self.strs[idx] == self.strs[idx-1] \
+                                    else Counter(self.strs[idx]))
+
+def get_common_chars(counts1, counts2):
+    ''' Return the size of the intersection of two character multisets (Counters). '''
+
+    if len(counts1) > len(counts2):
+        counts1, counts2 = counts2, counts1
+    return sum(min(count, counts2.get(char, 0)) for char, count in counts1.items())
+
+def get_common_counts(query_prf, choice_prf, common_letters=None):
+    ''' Return the number of characters two (processed) strings share, of their sorted tokens and of their sorted
+    unique tokens, given their profiles (and the number of non-space characters they share, if known). '''
+
+    if common_letters is None:
+        common_letters = get_common_chars(query_prf.letter_counts, choice_prf.letter_counts)
+    # sorted tokens are joined by single spaces
+    common_tokens = common_letters + min(query_prf.num_of_tokens, choice_prf.num_of_tokens) - 1
+    common_counts = [common_letters + min(query_prf.num_of_spaces, choice_prf.num_of_spaces), common_tokens]
+    if query_prf.char_counts[2] is query_prf.char_counts[1] and choice_prf.char_counts[2] is choice_prf.char_counts[1]:
+        common_counts.append(common_tokens)
+    else: # repeated tokens
+        common_counts.append(get_common_chars(query_prf.char_counts[2], choice_prf.char_counts[2]))
+    return common_counts
+
+def get_score_bound(query_prf, choice_prf, common_letters=None):
+    ''' Return an upper bound of fuzzywuzzy's WRatio score of two (processed) strings, given their profiles
+    (and the number of non-space characters they share, if known).
+    Every ratio WRatio takes (ratio, partial_ratio and their token sort/set variants) matches at most the
+    characters both compared strings share, and a token set ratio may only reach 100 if the strings share a token. '''
+
+    query_str, choice_str = query_prf.strs[0], choice_prf.strs[0]
+    if not query_str or not choice_str:
+        return 0
+    common_counts = get_common_counts(query_prf, choice_prf, common_letters)
+    shares_token = not query_prf.tokens.isdisjoint(choice_prf.tokens)
+    len_ratio = float(max(len(query_str), len(choice_str))) / min(len(query_str), len(choice_str))
+    # ratio of the strings, of their sorted tokens, and of their sorted unique tokens (without a shared token),
+    # rounded (to integers) as fuzzywuzzy's ratios are before being scaled
+    ratios = list()
+    for idx in range(3 if not shares_token else 2):
+        query_str, choice_str = query_prf.strs[idx], choice_prf.strs[idx]
+        if len_ratio < 1.5:
+            ratio = 2.0 * common_counts[idx] / (len(query_str) + len(choice_str))
+        else:
+            # the substring of the longer string compared may be cut short by its end, down to the shared characters
+            common = common_counts[idx]
+            shorter_len = min(len(query_str), len(choice_str))
+            ratio = 2.0 * common / (shorter_len + common) if common else 0.0
+            # partial ratios round to 100 from .995 on
+            ratio = 1.0 if ratio > .995 else ratio
+        ratios.append(intr(100 * ratio))
+    if shares_token:
+        ratios.append(100)
+
+    if len_ratio < 1.5:
+        return intr(max(ratios[0], .95 * max(ratios[1:])))
+    base = intr(200.0 * common_counts[0] / (len(query_prf.strs[0]) + len(choice_prf.strs[0])))
+    partial_scale = .6 if len_ratio > 8 else .9
+    return intr(max(base, partial_scale * ratios[0], .95 * partial_scale * max(ratios[1:])))
+
+class FuzzyIndex:
+    ''' A character inverted index over a list of choices, for fuzzy (fuzzywuzzy) search.
+    The characters a query shares with the choices are counted through the index, which bounds the score of
+    each choice from above without comparing strings (see get_score_bound). Choices are then scored best bound
+    first, and the search stops as soon as no bound can reach the worst of the results found so far: most choices
+    are never scored, and results are the ones of fuzzywuzzy.process.extract over all choices. '''
+
+    def __init__(self, choices):
+        self.choices = tuple(choices)
+        self.char_index = defaultdict(list) # character -> (index, count) of the choices holding it
+        self.profiles = list() # choice index -> ChoiceProfile
+        for idx, choice in enumerate(self.choices):
+            profile = ChoiceProfile(process_choice(choice))
+            self.profiles.append(profile)
+            for char, count in profile.letter_counts.items():
+                self.char_index[char].append((idx, count))
+
+    def __len__(self):
+        return len(self.choices)
+
+    def get_common_letters(self, query_prf):
+        ''' Return the number of (non-space) characters a query shares with each choice (Counter of choice indices). '''
+
+        common_letters = Counter()
+        for char, count in query_prf.letter_counts.items():
+            for idx, choice_count in self.char_index.get(char, ()):
+                common_letters[idx] += min(count, choice_count)
+        return common_letters
+
+    def search(self, query, limit):
+        ''' Return the top limit (choice, score) tuples matching a query, as fuzzywuzzy.process.extract. '''
+
+        processed_query = process_choice(query)
+        if not processed_query or not limit:
+            return extract(query, self.choices, limit=limit)
+
+        query_prf = ChoiceProfile(processed_query)
+        common_letters = self.get_common_letters(query_prf)
+        # choices ranked by (score, -index), the first ones of equal scores coming first as in a full scan
+        bounds = sorted(((get_score_bound(query_prf, choice_prf, common_letters=common_letters[idx]), -idx) \
+                         for idx, choice_prf in enumerate(self.profiles)), reverse=True)
+        top = list() # min-heap of the limit best (score, -index) so far
+        for bound, neg_idx in bounds:
+            if len(top) == limit and (bound, neg_idx) < top[0]:
+                break # no other choice can make the results
+            score = WRatio(processed_query, self.profiles[-neg_idx].strs[0], full_process=False)
+            if len(top) < limit:
+                heappush(top, (score, neg_idx))
+            elif (score, neg_idx) > top[0]:
+                heapreplace(top, (score, neg_idx))
+        return [(self.choices[-neg_idx], score) for score, neg_idx in sorted(top, reverse=True)]
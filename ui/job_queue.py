@@ -0,0 +1,104 @@
+from atomic_file import atomic_open
+from concurrent.futures import ThreadPoolExecutor
+from json import dump, load
+from os import listdir, makedirs, remove
+from os.path import exists, getmtime, join
+from threading import Lock
+from time import time
+from uuid import uuid4
+
+# job states
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+# extension of job status files (on-disk backend)
+JOB_FILE_EXT = '.job.json'
+
+class JobQueue:
+    ''' Runs functions in background worker threads and keeps the status of each job (state, progress, result).
+    Statuses are kept in memory, and (if storage_dir is given) also written to one json file per job
+    so that any worker process can report them. Statuses of jobs older than ttl seconds are dropped. '''
+
+    def __init__(self, num_of_workers, ttl, storage_dir=None):
+        self.ttl = ttl
+        self.storage_dir = storage_dir
+        self.executor = ThreadPoolExecutor(max_workers=num_of_workers)
+        self.jobs = dict() # job id -> status dictionary
+        self.lock = Lock()
+        if storage_dir and not exists(storage_dir):
+            makedirs(storage_dir)
+
+    def get_job_fname(self, job_id):
+        return join(self.storage_dir, job_id + JOB_FILE_EXT)
+
+    def update_status(self, job_id, **fields):
+        ''' Update fields of the status of a job (and store it). '''
+
+        with self.lock:
+            status = self.jobs[job_id]
+            status.update(fields)
+            status['updated'] = time()
+            if self.storage_dir:
+                with atomic_open(self.get_job_fname(job_id)) as outfile:
+                    dump(status, outfile)
+
+    def submit(self, func, *args, owner=None):
+        ''' Enqueue func(*args, progress_callback) and return the job id.
+        func reports its progress by calling progress_callback(num_of_steps_done, num_of_steps, message),
+        its return value (json-serializable) is stored as the job's result. '''
+
+        self.evict_expired()
+        job_id = uuid4().hex
+        with self.lock:
+            self.jobs[job_id] = {'id': job_id, 'owner': owner, 'status': JOB_QUEUED, 'progress': [0, 0],
+                                 'message': 'Waiting in queue', 'result': None, 'error': None, 'created': time()}
+        self.update_status(job_id)
+        self.executor.submit(self.run_job, job_id, func, args)
+        return job_id
+
+    def run_job(self, job_id, func, args):
+        ''' Run a job (in a worker thread), recording its progress, result or error. '''
+
+        def progress_callback(num_of_steps_done, num_of_steps, message):
+            self.update_status(job_id, progress=[num_of_steps_done, num_of_steps], message=message)
+
+        self.update_status(job_id, status=JOB_RUNNING, message='Started')
+        try:
+            result = func(*args, progress_callback)
+        except Exception as e:
+            self.update_status(job_id, status=JOB_FAILED, message='Failed', error=f'{type(e).__name__}: {e}')
+        else:
+            self.update_status(job_id, status=JOB_DONE, message='Done', result=result)
+
+    def get_status(self, job_id):
+        ''' Return (a copy of) the status of a job, or None if it is unknown. '''
+
+        with self.lock:
+            if job_id in self.jobs:
+                return dict(self.jobs[job_id])
+        if self.storage_dir:
+            try:
+                with open(self.get_job_fname(job_id), 'r') as read_file:
+                    return load(read_file)
+            except (OSError, ValueError):
+                pass
+        return None
+
+    def evict_expired(self):
+        ''' Drop the statuses of finished jobs created more than ttl seconds ago. '''
+
+        now = time()
+        with self.lock:
+            for job_id in [job_id for job_id, status in self.jobs.items() \
+                           if status['status'] in [JOB_DONE, JOB_FAILED] and now - status['created'] > self.ttl]:
+                del self.jobs[job_id]
+        if self.storage_dir:
+            for fname in listdir(self.storage_dir):
+                if not fname.endswith(JOB_FILE_EXT):
+                    continue
+                try:
+                    if now - getmtime(join(self.storage_dir, fname)) > self.ttl:
+                        remove(join(self.storage_dir, fname))
+                except OSError:
+                    pass # already removed by another worker
@@ -0,0 +1,157 @@
+from atomic_file import atomic_open, file_lock
+from contextlib import contextmanager
+from os import listdir, makedirs, remove, utime
+from os.path import exists, getmtime, join
+from pickle import dump, load, HIGHEST_PROTOCOL
+from threading import Lock
+from time import time
+
+# minimal number of seconds between two sweeps over the stored sessions (see evict_expired)
+SESSION_EVICT_INTERVAL = 60
+# extension of session files, and of their lock files (on-disk backend)
+SESSION_FILE_EXT = '.session'
+SESSION_LOCK_EXT = '.lock'
+
+class SessionStore:
+    ''' Per-session state dictionaries keyed by session id, dropped after ttl seconds without use.
+    States are kept in memory (single process), or pickled to one file per session under storage_dir
+    so that several worker processes can serve the same session. States should be small (they are read on
+    every request), large data belongs in files referenced by the state (which are left in place on eviction). '''
+
+    def __init__(self, ttl, new_state, storage_dir=None):
+        self.ttl = ttl
+        self.new_state = new_state
+        self.storage_dir = storage_dir
+        self.states = dict() # session id -> (last used time, state), in-memory backend
+        self.session_locks = dict() # session id -> lock, in-memory backend
+        self.lock = Lock()
+        self.last_evict_time = time()
+        if storage_dir and not exists(storage_dir):
+            makedirs(storage_dir)
+
+    def get_session_fname(self, sid):
+        return join(self.storage_dir, sid + SESSION_FILE_EXT)
+
+    def load(self, sid):
+        ''' Return the stored state of session sid (and mark it as used), or None if it is unknown or expired. '''
+
+        if self.storage_dir:
+            fname = self.get_session_fname(sid)
+            try:
+                if time() - getmtime(fname) <= self.ttl:
+                    with open(fname, 'rb') as read_file:
+                        state = load(read_file)
+                    utime(fname) # mark as used
+                    return state
+            except (OSError, EOFError):
+                pass
+            return None
+
+        with self.lock:
+            last_used, state = self.states.get(sid, (0, None))
+            if state is None or time() - last_used > self.ttl:
+                return None
+            self.states[sid] = (time(), state)
+        return state
+
+    @contextmanager
+    def lock_session(self, sid):
+        ''' Hold the lock of session sid (across worker processes, for the on-disk backend) while in the context. '''
+
+        if self.storage_dir:
+            with file_lock(self.get_session_fname(sid) + SESSION_LOCK_EXT):
+                yield
+            return
+
+        with self.lock:
+            session_lock = self.session_locks.setdefault(sid, Lock())
+        with session_lock:
+            yield
+
+    def get(self, sid):
+        ''' Return the state of session sid (a new, stored, state if it is unknown or expired). '''
+
+        self.evict_expired()
+        state = self.load(sid)
+        if state is None:
+            with self.lock_session(sid):
+                state = self.load(sid)
+                if state is None:
+                    state = self.new_state()
+                    self.put(sid, state)
+        return state
+
+    @contextmanager
+    def update(self, sid):
+        ''' Return a context holding the state of session sid, stored once the context exits (without an error).
+        Updates of a session are serialized (see lock_session), so concurrent requests do not lose each other's changes. '''
+
+        self.evict_expired()
+        with self.lock_session(sid):
+            state = self.load(sid)
+            if state is None:
+                state = self.new_state()
+            yield state
+            self.put(sid, state)
+
+    def put(self, sid, state):
+        ''' Store the state of session sid (and mark it as used). '''
+
+        if self.storage_dir:
+            with atomic_open(self.get_session_fname(sid), 'wb') as outfile:
+                dump(state, outfile, protocol=HIGHEST_PROTOCOL)
+            return
+
+        with self.lock:
+            self.states[sid] = (time(), state)
+
+    def delete(self, sid):
+        ''' Drop the state of session sid. '''
+
+        if self.storage_dir:
+            for fname in [self.get_session_fname(sid), self.get_session_fname(sid) + SESSION_LOCK_EXT]:
+                try:
+                    remove(fname)
+                except OSError:
+                    pass
+            return
+
+        with self.lock:
+            self.states.pop(sid, None)
+            self.session_locks.pop(sid, None)
+
+    def evict_expired(self):
+        ''' Drop the sessions not used for more than ttl seconds (at most once per SESSION_EVICT_INTERVAL). '''
+
+        now = time()
+        if now - self.last_evict_time < SESSION_EVICT_INTERVAL:
+            return
+        self.last_evict_time = now
+
+        expired = list()
+        if self.storage_dir:
+            for fname in listdir(self.storage_dir):
+                if not fname.endswith(SESSION_FILE_EXT):
+                    continue
+                try:
+                    if now - getmtime(join(self.storage_dir, fname)) > self.ttl:
+                        remove(join(self.storage_dir, fname))
+                        expired.append(fname[:-len(SESSION_FILE_EXT)])
+                except OSError:
+                    pass # already removed by another worker
+            for sid in expired:
+                try:
+                    remove(self.get_session_fname(sid) + SESSION_LOCK_EXT)
+                except OSError:
+                    pass
+        else:
+            with self.lock:
+                expired = [sid for sid, (last_used, _) in self.states.items() if now - last_used > self.ttl]
+                for sid in expired:
+                    del self.states[sid]
+                    self.session_locks.pop(sid, None)
+
+    def __len__(self):
+        if self.storage_dir:
+            return len([fname for fname in listdir(self.storage_dir) if fname.endswith(SESSION_FILE_EXT)])
+        return len(self.states)